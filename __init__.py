@@ -9,57 +9,386 @@ print(u"Executing pythonista_startup...")
 try:
     print(u"Importing submodules of pythonista_startup...")
     
-    import importlib
-    import sys
-    import traceback
-    
     # Modify this tuple to include the features you want.
     # See the individual files for a full description of each submodule.
-    for name in (
+    # An entry can be just the submodule name, or a tuple that also selects when the submodule is run:
+    # * ("name", "eager") - run during startup, before the console is usable. This is what a plain name does.
+    # * ("name", "deferred") - run on a background thread after startup has finished.
+    # * ("name", "on-demand", "trigger") - run the first time the builtin name "trigger" is used (called, printed, passed to isinstance or issubclass, or an attribute is accessed). The trigger name must not already be a builtin. The placeholder is removed before the submodule runs, so the submodule can define the name itself.
+    SUBMODULES = (
         ##"_preflight_hook_experiment",
         ##"customize_sys_hooks",
-        ##"enable_faulthandler",
+        ##("enable_faulthandler", "deferred"),
         "patch_stdstreams",
-        ##"restore_types",
-    ):
+        ##("restore_types", "on-demand", "instancemethod"),
+        ##"profile_imports",
+        ##"profile_sampling",
+    )
+    
+    # Import and run() times of each submodule are appended to this file as one JSON object per line, so that startup times can be compared across launches and updates.
+    # Set this to None to disable the timing log. The summary is printed either way.
+    TIMING_LOG = u"~/Documents/startuplog/startup-times.jsonl"
+    # When the timing log grows past this many bytes, its older half is deleted. None lets it grow without limit.
+    TIMING_LOG_MAX_BYTES = 256 * 1024
+    
+    # Maximum number of submodules whose run() is executed at the same time.
+    # Submodules can declare the names of other submodules that must run before them in a module-level DEPENDS_ON tuple, and the global state that their run() changes in a MUTATES tuple. Submodules that change the same state never run at the same time, and submodules that change the standard streams always run alone on the main thread.
+    # Output of submodules run on worker threads is collected and printed in the order of the tuple above. Output written directly to the console (e.g. using console.set_color) is not reordered.
+    # Set this to 1 to run all submodules one after another on the main thread.
+    # Under Python 2 this setting is ignored and the submodules always run one after another: the main thread holds the global import lock while pythonista_startup is imported, so a worker thread that imports anything would wait for it forever.
+    MAX_WORKERS = 4
+    
+    # Everything is done inside a function, so the many helper variables don't end up as globals of pythonista_startup.
+    def _load_submodules(submodules, timing_log, timing_log_max_bytes, max_workers):
+        try:
+            import builtins
+        except ImportError:
+            import __builtin__ as builtins
+        import datetime
+        import errno
+        import importlib
+        import io
+        import json
+        import os
+        import sys
+        import threading
+        import time
+        import traceback
+        
         try:
-            importlib.import_module("pythonista_startup." + name).run()
-        except: # Catch everything
-            print(u"Exception while running submodule {}:".format(name), file=sys.stderr)
-            traceback.print_exc()
+            clock = time.perf_counter
+        except AttributeError:
+            # Python 2 has no monotonic high-resolution clock.
+            clock = time.time
+        
+        # Changing any of these means that the output of other submodules can't be captured while the submodule is running.
+        STREAM_STATE = frozenset(("sys.stdin", "sys.stdout", "sys.stderr"))
+        
+        def import_submodule(name, mode):
+            # Times include everything imported by the submodule, either at import time or in run().
+            timing = {"name": name, "mode": mode, "import": None, "run": None, "ok": False}
+            start = clock()
+            try:
+                mod = importlib.import_module("pythonista_startup." + name)
+            except: # Catch everything
+                mod = None
+                print(u"Exception while importing submodule {}:".format(name), file=sys.stderr)
+                traceback.print_exc()
+            timing["import"] = clock() - start
+            return timing, mod
+        
+        def run_submodule(timing, mod):
+            start = clock()
+            try:
+                mod.run()
+                timing["ok"] = True
+            except: # Catch everything
+                print(u"Exception while running submodule {}:".format(timing["name"]), file=sys.stderr)
+                traceback.print_exc()
+            timing["run"] = clock() - start
+        
+        def load(name, mode):
+            timing, mod = import_submodule(name, mode)
+            if mod is not None:
+                run_submodule(timing, mod)
+            return timing
+        
+        class CapturedStream(object):
+            """Stands in for sys.stdout or sys.stderr while submodules are running on worker threads. Writes from worker threads are collected in per-thread lists, together with the real stream they were meant for. Writes from all other threads go to the real stream."""
+            
+            def __init__(self, real, outputs):
+                self._real = real
+                self._outputs = outputs
+            
+            def write(self, text):
+                output = self._outputs.get(threading.current_thread())
+                if output is None:
+                    return self._real.write(text)
+                else:
+                    output.append((self._real, text))
+            
+            def writelines(self, lines):
+                for line in lines:
+                    self.write(line)
+            
+            def __getattr__(self, name):
+                return getattr(self._real, name)
+        
+        def load_all(names, mode, parallel=True):
+            """Import the named submodules and run them, in parallel where their declarations allow it. Returns the list of timings.
+            Running in parallel replaces sys.stdout and sys.stderr for a while, to collect the output of the worker threads. That is only safe during startup, before any user code runs. Otherwise (parallel=False), the submodules are run one after another on the current thread, and the standard streams are left alone."""
+            
+            jobs = []
+            for name in names:
+                timing, mod = import_submodule(name, mode)
+                mutates = frozenset(getattr(mod, "MUTATES", ()))
+                jobs.append({
+                    "name": name,
+                    "timing": timing,
+                    "mod": mod,
+                    "depends_on": frozenset(getattr(mod, "DEPENDS_ON", ())),
+                    "mutates": mutates,
+                    "exclusive": max_workers <= 1 or not mutates.isdisjoint(STREAM_STATE),
+                    "output": [],
+                    "started": mod is None,
+                    "done": mod is None,
+                })
+            
+            # Sort the jobs so that every job comes after its dependencies, otherwise keeping the configured order.
+            # Dependencies that are not enabled are ignored, and so are dependencies that are part of a cycle.
+            ordered = []
+            placed = set()
+            while len(ordered) < len(jobs):
+                remaining = [job for job in jobs if job["name"] not in placed]
+                job = next((job for job in remaining if all(dep in placed or dep not in names for dep in job["depends_on"])), remaining[0])
+                job["depends_on"] = job["depends_on"] & placed
+                ordered.append(job)
+                placed.add(job["name"])
+            jobs = ordered
+            
+            if not parallel:
+                for job in jobs:
+                    if job["mod"] is not None:
+                        run_submodule(job["timing"], job["mod"])
+                return [job["timing"] for job in jobs]
+            
+            cond = threading.Condition()
+            outputs = {}
+            busy = set()
+            running = [0]
+            captured = []
+            
+            def install_capture():
+                if not captured:
+                    captured[:] = [sys.stdout, sys.stderr]
+                    sys.stdout = CapturedStream(sys.stdout, outputs)
+                    sys.stderr = CapturedStream(sys.stderr, outputs)
+            
+            def remove_capture():
+                if captured:
+                    sys.stdout, sys.stderr = captured
+                    del captured[:]
+            
+            def worker(job):
+                try:
+                    run_submodule(job["timing"], job["mod"])
+                finally:
+                    with cond:
+                        del outputs[threading.current_thread()]
+                        busy.difference_update(job["mutates"])
+                        running[0] -= 1
+                        job["done"] = True
+                        cond.notify()
+            
+            def can_start(index, job):
+                if job["started"]:
+                    return False
+                elif job["exclusive"]:
+                    # Exclusive jobs wait for everything before them, so their uncaptured output stays in order.
+                    return running[0] == 0 and all(other["done"] for other in jobs[:index])
+                else:
+                    return (
+                        running[0] < max_workers
+                        and busy.isdisjoint(job["mutates"])
+                        and all(other["done"] for other in jobs[:index] if other["name"] in job["depends_on"])
+                    )
+            
+            emitted = 0
+            try:
+                with cond:
+                    while True:
+                        # Print the collected output of all finished jobs, in order.
+                        while emitted < len(jobs) and jobs[emitted]["done"]:
+                            for stream, text in jobs[emitted]["output"]:
+                                stream.write(text)
+                            emitted += 1
+                        
+                        if emitted == len(jobs):
+                            break
+                        
+                        job = next((job for i, job in enumerate(jobs) if can_start(i, job)), None)
+                        
+                        if job is None:
+                            cond.wait()
+                        elif job["exclusive"]:
+                            job["started"] = True
+                            remove_capture()
+                            cond.release()
+                            try:
+                                run_submodule(job["timing"], job["mod"])
+                            finally:
+                                cond.acquire()
+                            job["done"] = True
+                        else:
+                            job["started"] = True
+                            install_capture()
+                            busy.update(job["mutates"])
+                            running[0] += 1
+                            thread = threading.Thread(target=worker, args=(job,), name="pythonista_startup submodule " + job["name"])
+                            thread.daemon = True
+                            outputs[thread] = job["output"]
+                            thread.start()
+            finally:
+                remove_capture()
+            
+            return [job["timing"] for job in jobs]
+        
+        def total(timing):
+            return (timing["import"] or 0.0) + (timing["run"] or 0.0)
+        
+        def report(title, timings, total_time):
+            print(u"{} (import + run), slowest first:".format(title))
+            for timing in sorted(timings, key=total, reverse=True):
+                print(u"\t{:8.2f} ms = {:8.2f} ms + {:8.2f} ms  {}{}".format(
+                    total(timing) * 1000.0,
+                    (timing["import"] or 0.0) * 1000.0,
+                    (timing["run"] or 0.0) * 1000.0,
+                    timing["name"],
+                    u"" if timing["ok"] else u" (failed)",
+                ))
+            print(u"\t{:8.2f} ms in total".format(total_time * 1000.0))
+        
+        def write_log(timings, total_time):
+            if timing_log is None:
+                return
+            
+            path = os.path.expanduser(timing_log)
+            line = json.dumps({
+                "time": datetime.datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "total": total_time,
+                "submodules": timings,
+            }, sort_keys=True).encode("utf-8") + b"\n"
+            
+            try:
+                # A normal launch only opens and appends to the log. The directory only has to be created the first time.
+                try:
+                    f = io.open(path, "ab")
+                except (IOError, OSError) as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+                    os.makedirs(os.path.dirname(path))
+                    f = io.open(path, "ab")
+                
+                with f:
+                    f.write(line)
+                    size = f.tell()
+                
+                if timing_log_max_bytes is not None and size > timing_log_max_bytes:
+                    # Keeping only the newer half means that this is only done again after many more launches.
+                    with io.open(path, "rb") as f:
+                        f.seek(size - timing_log_max_bytes // 2)
+                        data = f.read()
+                    with io.open(path, "wb") as f:
+                        f.write(data[data.find(b"\n") + 1:])
+            except (IOError, OSError):
+                print(u"Could not write startup timing log:", file=sys.stderr)
+                traceback.print_exc()
+        
+        def make_trigger(name, trigger):
+            lock = threading.Lock()
+            
+            def activate():
+                with lock:
+                    if getattr(builtins, trigger, None) is placeholder:
+                        delattr(builtins, trigger)
+                        timing = load(name, "on-demand")
+                        report(u"On-demand submodule time", [timing], total(timing))
+                
+                try:
+                    return getattr(builtins, trigger)
+                except AttributeError:
+                    raise NameError(u"Submodule {} did not define {}".format(name, trigger))
+            
+            class OnDemandPlaceholder(object):
+                def __getattr__(self, attr):
+                    return getattr(activate(), attr)
+                
+                def __call__(self, *args, **kwargs):
+                    return activate()(*args, **kwargs)
+                
+                def __repr__(self):
+                    return repr(activate())
+                
+                def __str__(self):
+                    return str(activate())
+                
+                # Type names are often used like this, which looks these methods up on the placeholder's class.
+                def __instancecheck__(self, instance):
+                    return isinstance(instance, activate())
+                
+                def __subclasscheck__(self, subclass):
+                    return issubclass(subclass, activate())
+            
+            placeholder = OnDemandPlaceholder()
+            setattr(builtins, trigger, placeholder)
+        
+        eager = []
+        deferred = []
+        
+        for entry in submodules:
+            if not isinstance(entry, tuple):
+                entry = (entry,)
+            
+            name = entry[0]
+            mode = entry[1] if len(entry) > 1 else "eager"
+            
+            if mode == "eager":
+                eager.append(name)
+            elif mode == "deferred":
+                deferred.append(name)
+            elif mode == "on-demand" and len(entry) > 2 and hasattr(builtins, entry[2]):
+                # The placeholder would hide the existing builtin, and activating it would delete it.
+                print(u"Trigger name {} of on-demand submodule {} is already a builtin, running it eagerly.".format(entry[2], name), file=sys.stderr)
+                eager.append(name)
+            elif mode == "on-demand" and len(entry) > 2:
+                make_trigger(name, entry[2])
+            elif mode == "on-demand":
+                print(u"No trigger name for on-demand submodule {}, running it eagerly.".format(name), file=sys.stderr)
+                eager.append(name)
+            else:
+                print(u"Unknown mode {!r} for submodule {}, running it eagerly.".format(mode, name), file=sys.stderr)
+                eager.append(name)
+        
+        start = clock()
+        # Under Python 2, worker threads would deadlock on the import lock held by the main thread (see MAX_WORKERS).
+        timings = load_all(eager, "eager", parallel=sys.version_info >= (3,))
+        eager_time = clock() - start
+        report(u"Submodule startup times", timings, eager_time)
+        
+        if not deferred:
+            write_log(timings, eager_time)
+            return
+        
+        def run_deferred():
+            start = clock()
+            # The console is already usable at this point, and user code may replace the standard streams at any time, so they must not be touched.
+            deferred_timings = load_all(deferred, "deferred", parallel=False)
+            report(u"Deferred submodule times", deferred_timings, clock() - start)
+            # The logged total only covers the time spent before the console was usable.
+            write_log(timings + deferred_timings, eager_time)
+        
+        thread = threading.Thread(target=run_deferred, name="pythonista_startup deferred submodules")
+        thread.daemon = True
+        thread.start()
     
-    del importlib
-    del sys
-    del traceback
-    del name
+    _load_submodules(SUBMODULES, TIMING_LOG, TIMING_LOG_MAX_BYTES, MAX_WORKERS)
+    
+    del SUBMODULES
+    del TIMING_LOG
+    del TIMING_LOG_MAX_BYTES
+    del MAX_WORKERS
+    del _load_submodules
     
     print(u"Done importing submodules of pythonista_startup.")
     
     # To disable globals clearing, comment out the next line.
     """
-    print(u"Preventing globals clearing...")
-    
-    import sys
-    import types
-    
-    class DirAllTheGlobals(types.ModuleType):
-        import __main__
-        
-        def __dir__(self):
-            return dir(type(self).__main__)
-    
     # THESE LINES MUST COME LAST.
     # Anything past this point is executed in the context of the old pythonista_startup module, which may already be partially garbage-collected.
-    new_module = DirAllTheGlobals(__name__, __doc__)
-    vars(new_module).update(vars(sys.modules["pythonista_startup"]))
-    sys.modules["pythonista_startup"] = new_module
-    
-    del sys
-    del types
-    del DirAllTheGlobals
-    del new_module
-    
-    print(u"Done preventing globals clearing.")
+    from . import prevent_globals_clearing
+    prevent_globals_clearing.run()
+    del prevent_globals_clearing
     #"""
     
 except: # Catch everything
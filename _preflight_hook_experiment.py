@@ -2,51 +2,163 @@
 
 from __future__ import absolute_import, division, print_function
 
+# run() replaces builtins.__import__, see the loop in __init__.py.
+DEPENDS_ON = ()
+MUTATES = ("builtins.__import__", "builtins.preflight_hooks")
+
 def run():
     print(u"Installing preflight hooks...")
     
     # There's no official way to add hooks that run before every script run.
     # However Pythonista's preflight code imports pythonista_startup once to check what names it contains.
-    # So we hack __import__ to run all functions in preflight_hooks whenever pythonista_startup is imported by specific bytecodes.
+    # So we hack __import__ to run all hooks in builtins.preflight_hooks whenever pythonista_startup is imported by specific bytecodes.
+    # Hooks are added using preflight_hooks.add(func, priority=0, background=False). Hooks with lower priority run first, and background hooks run on their own thread.
     
     try:
         import builtins
     except ImportError:
         import __builtin__ as builtins
+    import sys
+    import threading
+    import time
+    import traceback
+    
+    try:
+        clock = time.perf_counter
+    except AttributeError:
+        clock = time.time
     
-    preflight_hooks = []
+    # These blobs are the bytecodes of the main function of Pythonista's preflight code (from Pythonista 2 and 3 respectively), which is run once before every script run.
+    # A frozenset, so that checking a code object is a single hash lookup instead of comparing against every blob.
+    PREFLIGHT_BYTECODES = frozenset((
+        b'y\x0e\x00d\x00\x00d\x01\x00l\x00\x00TWn\x07\x00\x01\x01\x01n\x01\x00Xd\x02\x00S',
+        ##b'y\x1c\x00d\x01\x00d\x00\x00l\x00\x00}\x00\x00t\x01\x00|\x00\x00\x83\x01\x00}\x01\x00Wn\x0e\x00\x01\x01\x01g\x00\x00}\x01\x00Yn\x01\x00Xy\x15\x00t\x02\x00\x83\x00\x00\x01t\x03\x00|\x01\x00\x83\x01\x00\x01Wn\x08\x00\x01\x01\x01Yn\x01\x00Xd\x00\x00S',
+        b'y\x1c\x00d\x01\x00d\x00\x00l\x00\x00}\x00\x00t\x01\x00|\x00\x00\x83\x01\x00}\x01\x00Wn\x0e\x00\x01\x01\x01g\x00\x00}\x01\x00Yn\x01\x00Xyy\x00d\x01\x00d\x00\x00l\x02\x00}\x02\x00d\x01\x00d\x00\x00l\x03\x00}\x03\x00d\x01\x00d\x00\x00l\x04\x00}\x04\x00d\x01\x00d\x00\x00l\x05\x00}\x05\x00|\x02\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x03\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x04\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x05\x00j\x06\x00d\x00\x00\x83\x01\x00\x01t\x07\x00\x83\x00\x00\x01t\x08\x00|\x01\x00\x83\x01\x00\x01Wn\x08\x00\x01\x01\x01Yn\x01\x00Xd\x00\x00S',
+    ))
     
-    def _make_new_import():
-        import sys
+    class PreflightHooks(object):
+        """Registry of functions that are called before every script run.
+        Hooks are called in order of priority (lowest first), and in the order they were added if the priority is the same. An exception in one hook is printed and does not affect the other hooks."""
+        
+        def __init__(self):
+            self._hooks = [] # (priority, sequence number, hook, background)
+            self._sequence = 0
+            self._lock = threading.Lock()
+            # hook -> [number of calls, total time, time of last call]
+            self.timings = {}
+        
+        def add(self, hook, priority=0, background=False):
+            with self._lock:
+                self._hooks.append((priority, self._sequence, hook, background))
+                self._hooks.sort(key=lambda entry: entry[:2])
+                self._sequence += 1
+            return hook
+        
+        def remove(self, hook):
+            with self._lock:
+                self._hooks = [entry for entry in self._hooks if entry[2] is not hook]
+        
+        def __len__(self):
+            return len(self._hooks)
+        
+        def __iter__(self):
+            return iter([entry[2] for entry in self._hooks])
+        
+        def _call(self, hook):
+            start = clock()
+            try:
+                hook()
+            except Exception:
+                print(u"Exception in preflight hook {!r}:".format(hook), file=sys.stderr)
+                traceback.print_exc()
+            finally:
+                elapsed = clock() - start
+                with self._lock:
+                    timing = self.timings.setdefault(hook, [0, 0.0, 0.0])
+                    timing[0] += 1
+                    timing[1] += elapsed
+                    timing[2] = elapsed
+        
+        def run(self):
+            for priority, sequence, hook, background in self._hooks:
+                if background:
+                    thread = threading.Thread(target=self._call, args=(hook,), name="preflight hook {!r}".format(hook))
+                    thread.daemon = True
+                    thread.start()
+                else:
+                    self._call(hook)
         
+        def report(self):
+            """Print the number of calls and the time spent in each hook, slowest first."""
+            
+            with self._lock:
+                timings = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+            for hook, (calls, total, last) in timings:
+                print(u"{:8.2f} ms total, {:8.2f} ms last, {} calls: {!r}".format(total * 1000.0, last * 1000.0, calls, hook))
+        
+        def import_overhead(self, iterations=100000):
+            """Measure how much slower an import of an already imported module is with the patched __import__. Returns the overhead per import, in seconds."""
+            
+            patched = builtins.__import__
+            real = getattr(patched, "real_import", patched)
+            
+            times = []
+            for func in (real, patched):
+                start = clock()
+                for _ in range(iterations):
+                    func("sys")
+                times.append(clock() - start)
+            
+            return (times[1] - times[0]) / iterations
+    
+    def _make_new_import(preflight_hooks):
         _real_import = builtins.__import__
+        # id of code object -> (code object, whether it is preflight code)
+        # The code object is kept alive, so that its id can't be reused by a different code object.
+        classified = {}
         
-        def __import__(name, *args, **kwargs):
+        def is_preflight(code):
+            try:
+                cached_code, result = classified[id(code)]
+            except KeyError:
+                pass
+            else:
+                if cached_code is code:
+                    return result
+            
+            if len(classified) >= 64:
+                classified.clear()
+            
+            result = code.co_code in PREFLIGHT_BYTECODES
+            classified[id(code)] = (code, result)
+            return result
+        
+        # The parameters are spelled out, because packing and unpacking *args and **kwargs on every import is noticeably slower.
+        # Python 2 defaults to implicit relative imports (level -1).
+        def __import__(name, globals=None, locals=None, fromlist=(), level=0 if sys.version_info >= (3,) else -1):
+            # Only imports of pythonista_startup do any extra work, all other imports only pay for this comparison.
             if name == "pythonista_startup":
                 try:
                     f = sys._getframe(1)
                 except ValueError:
                     pass
                 else:
-                    # These blobs are the bytecodes of the main function of Pythonista's preflight code (from Pythonista 2 and 3 respectively), which is run once before every script run.
-                    if f.f_code.co_code in (
-                        b'y\x0e\x00d\x00\x00d\x01\x00l\x00\x00TWn\x07\x00\x01\x01\x01n\x01\x00Xd\x02\x00S',
-                        ##b'y\x1c\x00d\x01\x00d\x00\x00l\x00\x00}\x00\x00t\x01\x00|\x00\x00\x83\x01\x00}\x01\x00Wn\x0e\x00\x01\x01\x01g\x00\x00}\x01\x00Yn\x01\x00Xy\x15\x00t\x02\x00\x83\x00\x00\x01t\x03\x00|\x01\x00\x83\x01\x00\x01Wn\x08\x00\x01\x01\x01Yn\x01\x00Xd\x00\x00S',
-                        b'y\x1c\x00d\x01\x00d\x00\x00l\x00\x00}\x00\x00t\x01\x00|\x00\x00\x83\x01\x00}\x01\x00Wn\x0e\x00\x01\x01\x01g\x00\x00}\x01\x00Yn\x01\x00Xyy\x00d\x01\x00d\x00\x00l\x02\x00}\x02\x00d\x01\x00d\x00\x00l\x03\x00}\x03\x00d\x01\x00d\x00\x00l\x04\x00}\x04\x00d\x01\x00d\x00\x00l\x05\x00}\x05\x00|\x02\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x03\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x04\x00j\x06\x00d\x00\x00\x83\x01\x00\x01|\x05\x00j\x06\x00d\x00\x00\x83\x01\x00\x01t\x07\x00\x83\x00\x00\x01t\x08\x00|\x01\x00\x83\x01\x00\x01Wn\x08\x00\x01\x01\x01Yn\x01\x00Xd\x00\x00S',
-                    ):
-                        for hook in preflight_hooks:
-                            hook()
+                    if is_preflight(f.f_code):
+                        preflight_hooks.run()
             
-            return _real_import(name, *args, **kwargs)
+            return _real_import(name, globals, locals, fromlist, level)
         
         __import__.patched = True
+        __import__.real_import = _real_import
+        __import__.preflight_hooks = preflight_hooks
         
         return __import__
     
     if not getattr(builtins.__import__, "patched", False):
-        builtins.__import__ = _make_new_import()
+        builtins.__import__ = _make_new_import(PreflightHooks())
+    
+    builtins.preflight_hooks = builtins.__import__.preflight_hooks
     
-    del builtins
     del _make_new_import
     
     print(u"Done installing preflight hooks.")
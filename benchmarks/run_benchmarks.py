@@ -0,0 +1,494 @@
+"""Benchmarks for pythonista_startup that run on a normal computer instead of an iOS device.
+
+The console and objc_util modules only exist in Pythonista, so the stand-ins in the stubs folder are used instead. They do nothing except count how often each function is called. The standard streams are replaced with simple objects (like Pythonista's, their classes can be patched), which count the writes and otherwise discard the output.
+
+Every benchmark runs in a fresh Python process, so that the global state changed by one submodule doesn't influence the others. The home directory is also replaced with a temporary one, so that log files are not written into the real ~/Documents. The repository folder is loaded as the pythonista_startup package, whatever its actual name is.
+
+Benchmarks:
+
+* startup: import and run() time of every submodule on its own, and the time to execute the whole pythonista_startup package with its current SUBMODULES. Each is measured in STARTUP_RUNS fresh processes.
+* restore_types: a full run() and a refresh_types() without new types, with a deep and with a diamond-heavy class hierarchy (and without either, for comparison).
+* displayhook: time to display large objects with customize_sys_hooks installed.
+* excepthook: time to display tracebacks with 10, 100 and 1000 frames, and a chain of exceptions, with customize_sys_hooks installed.
+* import_overhead: time of import statements with and without the preflight hook from _preflight_hook_experiment installed.
+
+All times are in milliseconds. The results are written to a JSON file. If a baseline results file is given, every median that got slower by more than the tolerance is reported, and the exit status is 1.
+
+Usage: python benchmarks/run_benchmarks.py [-o results.json] [--baseline old-results.json] [--tolerance 0.25] [--quick] [benchmark ...]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import datetime
+import importlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+STUB_DIR = os.path.join(BENCHMARK_DIR, "stubs")
+
+# Submodules whose startup time is measured. prevent_globals_clearing is left out, because it is not a normal submodule.
+SUBMODULES = (
+    "_preflight_hook_experiment",
+    "customize_sys_hooks",
+    "enable_faulthandler",
+    "patch_stdstreams",
+    "profile_imports",
+    "profile_sampling",
+    "restore_types",
+)
+
+# Number of fresh processes in which each startup time is measured.
+STARTUP_RUNS = 5
+# Number of measurements of everything else. The median and minimum are reported.
+REPEAT = 7
+
+clock = time.perf_counter
+
+def summarize(samples):
+    """Summarize a list of times in seconds as milliseconds."""
+    
+    samples = sorted(samples)
+    middle = len(samples) // 2
+    median = samples[middle] if len(samples) % 2 else (samples[middle - 1] + samples[middle]) / 2
+    return {
+        "runs": len(samples),
+        "min": samples[0] * 1000.0,
+        "median": median * 1000.0,
+        "mean": sum(samples) / len(samples) * 1000.0,
+    }
+
+def measure(func, repeat=REPEAT, number=1):
+    """Call func number times, repeat times, and summarize the time per call."""
+    
+    samples = []
+    for _ in range(repeat):
+        start = clock()
+        for _ in range(number):
+            func()
+        samples.append((clock() - start) / number)
+    return summarize(samples)
+
+class ConsoleOutput(object):
+    """Stand-in for Pythonista's stdout and stderr."""
+    
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+    
+    def write(self, text):
+        self.writes += 1
+        self.chars += len(text)
+        return len(text)
+    
+    def flush(self):
+        pass
+
+class ConsoleInput(object):
+    """Stand-in for Pythonista's stdin. There is never any input."""
+    
+    def readline(self):
+        return u""
+
+def platform_calls():
+    """Return the number of calls to the stand-in platform modules so far, by function name."""
+    
+    import console
+    import objc_util
+    
+    calls = {}
+    for module in (console, objc_util):
+        for name, count in module.calls.items():
+            calls[module.__name__ + "." + name] = count
+    return calls
+
+def output_stats():
+    stats = {}
+    for name in ("stdout", "stderr"):
+        stream = getattr(sys, name)
+        # With buffering enabled in patch_stdstreams, the original stream is wrapped.
+        stream = getattr(stream, "_stream", stream)
+        stats[name] = {"writes": getattr(stream, "writes", None), "chars": getattr(stream, "chars", None)}
+    return stats
+
+def setup_worker():
+    """Prepare a worker process: stand-in modules and streams, and the repository as the pythonista_startup package (not executed yet). Returns the package's module and spec."""
+    
+    sys.path.insert(0, STUB_DIR)
+    sys.stdin = ConsoleInput()
+    sys.stdout = ConsoleOutput()
+    sys.stderr = ConsoleOutput()
+    
+    spec = importlib.util.spec_from_file_location("pythonista_startup", os.path.join(REPO_DIR, "__init__.py"), submodule_search_locations=[REPO_DIR])
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["pythonista_startup"] = package
+    return package, spec
+
+def bench_startup_submodule(args):
+    """Import and run() time of a single submodule, in a fresh process."""
+    
+    setup_worker()
+    
+    start = clock()
+    mod = importlib.import_module("pythonista_startup." + args.name)
+    imported = clock()
+    mod.run()
+    done = clock()
+    
+    return {
+        "import": (imported - start) * 1000.0,
+        "run": (done - imported) * 1000.0,
+        "total": (done - start) * 1000.0,
+        "platform_calls": platform_calls(),
+        "output": output_stats(),
+    }
+
+def bench_startup_package(args):
+    """Time to execute the whole pythonista_startup package, in a fresh process."""
+    
+    package, spec = setup_worker()
+    
+    start = clock()
+    spec.loader.exec_module(package)
+    done = clock()
+    
+    return {
+        "total": (done - start) * 1000.0,
+        "platform_calls": platform_calls(),
+        "output": output_stats(),
+    }
+
+def build_hierarchy(kind, size):
+    """Create a class hierarchy in a new module named benchmark_types. The classes are not attributes of the module, so restore_types has to find them. Returns the list of classes, which must be kept alive."""
+    
+    import types
+    
+    sys.modules.setdefault("benchmark_types", types.ModuleType("benchmark_types"))
+    
+    def make(name, bases):
+        return type(name, bases, {"__module__": "benchmark_types"})
+    
+    classes = []
+    if kind == "deep":
+        # A single chain of size classes.
+        base = object
+        for i in range(size):
+            base = make("Deep{}".format(i), (base,))
+            classes.append(base)
+    elif kind == "diamond":
+        # size layers of size classes. Every class inherits from two neighboring classes of the previous layer, so most classes are reachable through several paths.
+        layer = [make("Diamond0_{}".format(i), (object,)) for i in range(size)]
+        classes.extend(layer)
+        for depth in range(1, size):
+            layer = [make("Diamond{}_{}".format(depth, i), tuple(layer[i:i + 2])) for i in range(size)]
+            classes.extend(layer)
+    
+    return classes
+
+def bench_restore_types(args):
+    """Full run() and refresh_types() without changes, with a synthetic class hierarchy."""
+    
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    
+    setup_worker()
+    classes = build_hierarchy(args.name, args.size) if args.name != "none" else []
+    
+    restore_types = importlib.import_module("pythonista_startup.restore_types")
+    
+    start = clock()
+    restore_types.run()
+    first = clock() - start
+    
+    return {
+        "classes": len(classes),
+        "first_run": first * 1000.0,
+        "run": measure(restore_types.run, repeat=args.repeat),
+        "refresh_unchanged": measure(builtins.refresh_types, repeat=args.repeat),
+    }
+
+def bench_displayhook(args):
+    """Time to display large objects."""
+    
+    setup_worker()
+    importlib.import_module("pythonista_startup.customize_sys_hooks").run()
+    
+    import console
+    
+    count = 10000 if args.quick else 1000000
+    objects = collections.OrderedDict((
+        ("small_int", 42),
+        ("list", list(range(count))),
+        ("dict", {i: str(i) for i in range(count // 10)}),
+        ("set", set(range(count // 10))),
+        ("str", u"x" * count),
+        ("bytes", b"x" * count),
+        ("nested", [[[list(range(10))] * 10] * 10] * 10),
+    ))
+    
+    # Deeply nested lists, 500 levels.
+    deep = []
+    for _ in range(500):
+        deep = [deep]
+    objects["deep"] = deep
+    
+    results = {}
+    for name, obj in objects.items():
+        calls_before = sum(console.calls.values())
+        results[name] = measure(lambda: sys.displayhook(obj), repeat=args.repeat, number=5)
+        results[name]["console_calls_per_call"] = (sum(console.calls.values()) - calls_before) / (args.repeat * 5)
+    
+    return results
+
+def raise_after(depth):
+    if depth <= 1:
+        raise ValueError(u"benchmark exception")
+    raise_after(depth - 1)
+
+def raise_chained(count, depth):
+    """Raise an exception that has count - 1 exceptions chained to it. The innermost one has a traceback of depth frames."""
+    
+    if count <= 1:
+        raise_after(depth)
+    
+    try:
+        raise_chained(count - 1, depth)
+    except ValueError as exc:
+        # Alternate between explicit (__cause__) and implicit (__context__) chaining.
+        if count % 2:
+            raise KeyError(count) from exc
+        raise ValueError(u"chained exception {}".format(count))
+    except KeyError:
+        raise ValueError(u"chained exception {}".format(count))
+
+def bench_excepthook(args):
+    """Time to display tracebacks of different lengths."""
+    
+    setup_worker()
+    importlib.import_module("pythonista_startup.customize_sys_hooks").run()
+    
+    import console
+    
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 5000))
+    
+    scenarios = collections.OrderedDict((
+        ("frames_10", lambda: raise_after(10)),
+        ("frames_100", lambda: raise_after(100)),
+        ("frames_1000", lambda: raise_after(1000)),
+        ("chained_20x10", lambda: raise_chained(20, 10)),
+    ))
+    
+    results = {}
+    for name, func in scenarios.items():
+        try:
+            func()
+        except Exception:
+            exc_info = sys.exc_info()
+        
+        calls_before = sum(console.calls.values())
+        # Like Pythonista, customize_sys_hooks replaces sys.__excepthook__, not sys.excepthook.
+        results[name] = measure(lambda: sys.__excepthook__(*exc_info), repeat=args.repeat, number=5)
+        results[name]["console_calls_per_call"] = (sum(console.calls.values()) - calls_before) / (args.repeat * 5)
+        del exc_info
+    
+    return results
+
+def bench_import_overhead(args):
+    """Time of import statements of already loaded modules, with and without the preflight hook."""
+    
+    setup_worker()
+    
+    def import_plain():
+        import os
+    
+    def import_from():
+        from os import path
+    
+    def import_startup():
+        import pythonista_startup
+    
+    number = 10000 if args.quick else 100000
+    statements = collections.OrderedDict((
+        ("import", import_plain),
+        ("from_import", import_from),
+        ("import_pythonista_startup", import_startup),
+    ))
+    
+    results = collections.OrderedDict()
+    for name, func in statements.items():
+        results["plain_" + name] = measure(func, repeat=args.repeat, number=number)
+    
+    importlib.import_module("pythonista_startup._preflight_hook_experiment").run()
+    
+    for name, func in statements.items():
+        results["hooked_" + name] = measure(func, repeat=args.repeat, number=number)
+    
+    return results
+
+WORKERS = {
+    "startup_submodule": bench_startup_submodule,
+    "startup_package": bench_startup_package,
+    "restore_types": bench_restore_types,
+    "displayhook": bench_displayhook,
+    "excepthook": bench_excepthook,
+    "import_overhead": bench_import_overhead,
+}
+
+def run_worker(home, worker, name=None, quick=False, repeat=REPEAT, size=None):
+    """Run a worker in a fresh process and return its result."""
+    
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    
+    command = [sys.executable, os.path.abspath(__file__), "--worker", worker, "--result-file", result_path, "--repeat", str(repeat)]
+    if name is not None:
+        command += ["--name", name]
+    if size is not None:
+        command += ["--size", str(size)]
+    if quick:
+        command.append("--quick")
+    
+    env = dict(os.environ, HOME=home)
+    try:
+        subprocess.check_call(command, env=env, cwd=home)
+        with io.open(result_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+def run_startup(home, args):
+    results = collections.OrderedDict()
+    runs = 2 if args.quick else STARTUP_RUNS
+    
+    for name in SUBMODULES + (None,):
+        samples = [run_worker(home, "startup_submodule" if name else "startup_package", name, args.quick) for _ in range(runs)]
+        
+        result = collections.OrderedDict()
+        for key in ("import", "run", "total"):
+            if key in samples[0]:
+                result[key] = summarize([sample[key] / 1000.0 for sample in samples])
+        # Call counts and output are the same in every run.
+        result["platform_calls"] = samples[0]["platform_calls"]
+        result["output"] = samples[0]["output"]
+        results[name or "package"] = result
+    
+    return results
+
+def run_restore_types(home, args):
+    results = collections.OrderedDict()
+    for kind, size in (("none", 0), ("deep", 100 if args.quick else 400), ("diamond", 10 if args.quick else 40)):
+        results[kind] = run_worker(home, "restore_types", kind, args.quick, args.repeat, size)
+    return results
+
+BENCHMARKS = collections.OrderedDict((
+    ("startup", run_startup),
+    ("restore_types", run_restore_types),
+    ("displayhook", lambda home, args: run_worker(home, "displayhook", quick=args.quick, repeat=args.repeat)),
+    ("excepthook", lambda home, args: run_worker(home, "excepthook", quick=args.quick, repeat=args.repeat)),
+    ("import_overhead", lambda home, args: run_worker(home, "import_overhead", quick=args.quick, repeat=args.repeat)),
+))
+
+def find_regressions(baseline, results, tolerance, path=()):
+    """Compare every median in results with the one at the same place in baseline. Yields (path, old, new) for the ones that got slower by more than tolerance."""
+    
+    if not isinstance(baseline, dict) or not isinstance(results, dict):
+        return
+    
+    if "median" in results and "median" in baseline:
+        if results["median"] > baseline["median"] * (1.0 + tolerance):
+            yield path, baseline["median"], results["median"]
+        return
+    
+    for key, value in results.items():
+        if key in baseline:
+            for regression in find_regressions(baseline[key], value, tolerance, path + (key,)):
+                yield regression
+
+def main():
+    parser = argparse.ArgumentParser(description=u"Run the pythonista_startup benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", help=u"benchmarks to run: {} (default: all)".format(u", ".join(BENCHMARKS)))
+    parser.add_argument("-o", "--output", default=u"benchmark-results.json", help=u"file to write the results to")
+    parser.add_argument("--baseline", help=u"results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help=u"allowed slowdown relative to the baseline (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help=u"use smaller inputs and fewer runs")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help=argparse.SUPPRESS)
+    parser.add_argument("--worker", choices=list(WORKERS), help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    parser.add_argument("--name", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker is not None:
+        try:
+            result = WORKERS[args.worker](args)
+        except Exception:
+            # The worker's sys.stderr is a stand-in that discards everything.
+            traceback.print_exc(file=sys.__stderr__)
+            return 1
+        
+        with io.open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+    
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(u"unknown benchmark: {}".format(name))
+    
+    if args.quick and args.repeat == REPEAT:
+        args.repeat = 3
+    
+    home = tempfile.mkdtemp(prefix=u"pythonista_startup-benchmarks-")
+    os.mkdir(os.path.join(home, "Documents"))
+    
+    output = collections.OrderedDict((
+        ("time", datetime.datetime.now().isoformat()),
+        ("python", sys.version.split()[0]),
+        ("implementation", platform.python_implementation()),
+        ("platform", platform.platform()),
+        ("quick", args.quick),
+        ("results", collections.OrderedDict()),
+    ))
+    
+    try:
+        for name in args.benchmarks or BENCHMARKS:
+            print(u"Running {}...".format(name))
+            start = clock()
+            output["results"][name] = BENCHMARKS[name](home, args)
+            print(u"Done running {} ({:.1f} s).".format(name, clock() - start))
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    
+    with io.open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(u"Wrote results to {}".format(args.output))
+    
+    if args.baseline is not None:
+        with io.open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        
+        regressions = list(find_regressions(baseline.get("results", {}), output["results"], args.tolerance))
+        for path, old, new in regressions:
+            print(u"Slower: {}: {:.3f} ms -> {:.3f} ms ({:+.0f}%)".format(u"/".join(path), old, new, (new / old - 1.0) * 100.0))
+        
+        if regressions:
+            return 1
+        print(u"No regressions compared to {}.".format(args.baseline))
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""Stand-in for Pythonista's console module, so that the benchmarks can run on a normal computer.
+
+Nothing is displayed. Every call is only counted in calls, by function name.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+
+calls = collections.Counter()
+
+def _counted(name):
+    def func(*args, **kwargs):
+        calls[name] += 1
+    
+    func.__name__ = name
+    return func
+
+clear = _counted("clear")
+set_color = _counted("set_color")
+set_font = _counted("set_font")
+write_link = _counted("write_link")
+hide_output = _counted("hide_output")
+show_activity = _counted("show_activity")
+hide_activity = _counted("hide_activity")
+hud_alert = _counted("hud_alert")
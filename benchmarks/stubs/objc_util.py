@@ -0,0 +1,41 @@
+"""Stand-in for Pythonista's objc_util module, so that the benchmarks can run on a normal computer.
+
+Only the parts used by pythonista_startup exist. There is no Objective-C runtime, so functions called through c do nothing and return None, and on_main_thread calls the function directly on the current thread. Every call is counted in calls.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import functools
+
+calls = collections.Counter()
+
+def on_main_thread(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        calls["on_main_thread"] += 1
+        return func(*args, **kwargs)
+    
+    return wrapper
+
+class ObjCInstance(object):
+    def __init__(self, ptr):
+        calls["ObjCInstance"] += 1
+        self.ptr = ptr
+
+class _CFunction(object):
+    def __init__(self, name):
+        self.name = name
+        self.argtypes = None
+        self.restype = None
+    
+    def __call__(self, *args):
+        calls["c." + self.name] += 1
+
+class _CLibrary(object):
+    def __getattr__(self, name):
+        func = _CFunction(name)
+        setattr(self, name, func)
+        return func
+
+c = _CLibrary()
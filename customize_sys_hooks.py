@@ -3,35 +3,88 @@
 Both of these use custom coloring. The default colors are based on the default theme, if you use something different the colors will not match your theme and may not look nice. If you're using a dark theme, you won't be able to read anything.
 
 Features of the displayhook:
-* Basic IPython-style output history. There is a global list named Out (technically added to the builtins/__builtin__ module) which contains the results of all expressions run in the interactive console.
+* Basic IPython-style output history. There is a global named Out (technically added to the builtins/__builtin__ module) which contains the results of all expressions run in the interactive console. Out[n] works like with a list, but old results are evicted once the history has more than OUT_MAX_ENTRIES entries or takes up more than about OUT_MAX_BYTES bytes. Evicted results can still be accessed if they are alive elsewhere (OUT_KEEP_WEAKREFS), or if they were pickled to disk (OUT_SPILL_DIR).
 * The result lines show at which position in the Out list the result can be found, for later reference.
+* Results are printed using a reprlib-based repr with limits on length, nesting depth, number of container items, and time (see the REPR_* settings), so that huge results don't freeze the console. If anything was left out, a note says so - the full repr can still be printed using print(repr(Out[n])).
 * Like the default displayhook, expressions that return None are ignored - nothing is printed, and the value of _ is not changed. This can be changed so that None is displayed and stored in _ and Out, by uncommmenting a line in the displayhook definition.
 
 Features of the excepthook:
 * A little more whitespace to make the traceback more readable.
+* Runs of identical frames (e.g. from deep recursion) are shown only once, followed by a note how often the frame was repeated. Very long tracebacks only show their first TRACEBACK_HEAD and last TRACEBACK_TAIL entries. Source code is only loaded for frames that are actually shown.
+* The whole traceback is rendered in memory first and then written with as few color changes and writes as possible, so even very long tracebacks print quickly.
 * The traceback uses different colors for text, file paths, line numbers, etc.
 * Syntax errors use Unicode magic and color changing to mark at which character the syntax error occurred. Admittedly this does not always work well and may be more "look at my fancy graphics" than useful.
-* Source file paths are shortened and do not show the long path of the app sandbox.
+* Source file paths are shortened and do not show the long path of the app sandbox. The shortened paths and link URLs of recently shown files are cached (FILENAME_CACHE_SIZE).
 * Source file paths are tappable links that open in the Pythonista editor. This uses the normal pythonista:// URL scheme, which means that files are *not* opened in a new tab. Instead they replace whatever was open in your last active tab.
-* Python 3 chained exceptions *should* work. No, that cannot be backported to Python 2.
+* Python 3 chained exceptions *should* work. No, that cannot be backported to Python 2. The chain is collected without recursion, stops at reference cycles, and only the last MAX_CHAINED_EXCEPTIONS exceptions are shown.
 """
 
 from __future__ import absolute_import, division, print_function
 
+# Scheduling information for __init__.py: run() only replaces the two hooks.
+DEPENDS_ON = ()
+MUTATES = ("sys.displayhook", "sys.__excepthook__")
+
 def run():
     try:
         import builtins
     except ImportError:
         import __builtin__ as builtins
+    import collections
     import console
+    import io
     import os
     import sys
+    import itertools
+    import linecache
+    import tempfile
+    import time
     import traceback
+    import weakref
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    try:
+        import reprlib
+    except ImportError:
+        import repr as reprlib
     try:
         from urllib.parse import quote
     except ImportError:
         from urllib import quote
     
+    # Maximum number of results kept in memory by Out. None means no limit.
+    OUT_MAX_ENTRIES = 1000
+    # Maximum approximate total size of the results kept in memory by Out, in bytes. None means no limit.
+    # Sizes are measured using sys.getsizeof, so for containers the size of the contents is not included. The newest result is always kept.
+    OUT_MAX_BYTES = 64 * 1024 * 1024
+    # Whether to keep weak references to evicted results. Such results are still available from Out as long as something else keeps them alive.
+    OUT_KEEP_WEAKREFS = True
+    # Directory to pickle evicted results into, so they can still be loaded from Out later. None disables this.
+    # Every Out history uses its own new subdirectory, so the temporary directory is a good choice, e.g. tempfile.gettempdir().
+    OUT_SPILL_DIR = None
+    
+    # Limits for the repr of results printed by the displayhook. Set REPR_BOUNDED to False to always print the full repr.
+    REPR_BOUNDED = True
+    # Maximum length of the printed repr, in characters.
+    REPR_MAX_LENGTH = 10000
+    # Maximum nesting depth of containers.
+    REPR_MAX_DEPTH = 6
+    # Maximum number of items shown per container.
+    REPR_MAX_ITEMS = 100
+    # Time after which all remaining parts of the repr are left out, in seconds.
+    REPR_TIMEOUT = 0.5
+    
+    # Number of traceback entries to show from the start and from the end of a long traceback. Repeated frames only count as a single entry.
+    # Set either to None to always show the entire traceback.
+    TRACEBACK_HEAD = 25
+    TRACEBACK_TAIL = 25
+    # Maximum number of exceptions to show from a chain of causes and contexts.
+    MAX_CHAINED_EXCEPTIONS = 20
+    # Number of source file paths for which the shortened path and the link URL are remembered. 0 or None disables the cache.
+    FILENAME_CACHE_SIZE = 256
+    
     print(u"Customizing sys hooks...")
     
     APP_GROUP_DIR = os.path.expanduser(u"~")
@@ -44,10 +97,73 @@ def run():
     
     DOCUMENTS = os.path.expanduser("~/Documents")
     
-    def write_filename(path):
+    COLOR_TEXT = (0.2, 0.2, 0.2)
+    COLOR_ERROR = (0.75, 0.0, 0.0)
+    COLOR_FILENAME = (0.81, 0.32, 0.29)
+    COLOR_LINENO = (0.15, 0.51, 0.84)
+    COLOR_NAME = (0.13, 0.46, 0.49)
+    COLOR_MODULE = (0.43, 0.25, 0.66)
+    COLOR_OUT = (0.0, 0.5, 0.0)
+    COLOR_RESULT = (0.33, 0.57, 1.0)
+    
+    class StyledText(object):
+        """Colored text and links, collected in memory and then written to the console in one go.
+        Consecutive text with the same color is merged into one write, and whitespace-only text never causes a color change, so the number of console calls depends only on the number of color changes."""
+        
+        def __init__(self):
+            # Each span is [color, list of text parts, link URL or None, whether the text is only whitespace].
+            self.spans = []
+        
+        def write(self, color, text):
+            if not text:
+                return
+            
+            blank = text.isspace()
+            if self.spans and self.spans[-1][2] is None:
+                last = self.spans[-1]
+                if last[0] == color or blank:
+                    last[1].append(text)
+                    last[3] = last[3] and blank
+                    return
+                elif last[3]:
+                    # Whitespace looks the same in every color.
+                    last[0] = color
+                    last[1].append(text)
+                    last[3] = False
+                    return
+            
+            self.spans.append([color, [text], None, blank])
+        
+        def write_link(self, color, text, url):
+            self.spans.append([color, [text], url, False])
+        
+        def flush(self):
+            current = None
+            for color, parts, url, _ in self.spans:
+                if color != current:
+                    console.set_color(*color)
+                    current = color
+                
+                if url is None:
+                    sys.stdout.write(u"".join(parts))
+                else:
+                    console.write_link(u"".join(parts), url)
+            
+            del self.spans[:]
+    
+    URL_SCHEME = u"pythonista3://" if os.path.basename(sys.executable) == "Pythonista3" else u"pythonista://"
+    
+    # Shortened paths and URLs of recently shown source files, most recently used last.
+    filename_cache = collections.OrderedDict()
+    
+    def write_filename(out, path):
         if path.startswith(u"<") and path.endswith(u">"):
-            print(path, end=u"")
-        else:
+            out.write(COLOR_FILENAME, path)
+            return
+        
+        try:
+            short_path, url = filename_cache.pop(path)
+        except KeyError:
             short_path = path
             
             for prefix in REMOVE_PREFIXES:
@@ -55,7 +171,234 @@ def run():
                     short_path = path[len(prefix):]
                     break
             
-            console.write_link(short_path, (u"pythonista3://" if os.path.basename(sys.executable) == "Pythonista3" else u"pythonista://") + quote(os.path.relpath(path, DOCUMENTS)))
+            url = URL_SCHEME + quote(os.path.relpath(path, DOCUMENTS))
+            
+            # A cache size of 0 or None disables the cache.
+            if not FILENAME_CACHE_SIZE:
+                out.write_link(COLOR_FILENAME, short_path, url)
+                return
+            
+            if len(filename_cache) >= FILENAME_CACHE_SIZE:
+                filename_cache.popitem(last=False)
+        
+        filename_cache[path] = (short_path, url)
+        out.write_link(COLOR_FILENAME, short_path, url)
+    
+    class OutHistory(object):
+        """Output history with a bounded number of results and memory use. Indices never change, even after old results are evicted."""
+        
+        def __init__(self, max_entries=OUT_MAX_ENTRIES, max_bytes=OUT_MAX_BYTES, keep_weakrefs=OUT_KEEP_WEAKREFS, spill_dir=OUT_SPILL_DIR):
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.keep_weakrefs = keep_weakrefs
+            self.spill_dir = spill_dir
+            self._count = 0
+            self._entries = collections.OrderedDict() # index -> (result, size)
+            self._bytes = 0
+            self._weakrefs = {} # index -> weak reference
+            self._spilled = {} # index -> path of pickle file
+            self._spill_subdir = None
+        
+        def __len__(self):
+            return self._count
+        
+        def __repr__(self):
+            return u"<Out history: {} results, {} in memory, {} pickled>".format(self._count, len(self._entries), len(self._spilled))
+        
+        def append(self, obj):
+            try:
+                size = sys.getsizeof(obj)
+            except TypeError:
+                size = 0
+            
+            self._entries[self._count] = (obj, size)
+            self._bytes += size
+            self._count += 1
+            
+            while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1)
+            ):
+                index, (old, size) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self._evict(index, old)
+        
+        def _evict(self, index, obj):
+            if self.keep_weakrefs:
+                try:
+                    # The callback removes the entry once the result is garbage-collected.
+                    self._weakrefs[index] = weakref.ref(obj, lambda ref, index=index, weakrefs=self._weakrefs: weakrefs.pop(index, None))
+                except TypeError:
+                    pass
+            
+            if self.spill_dir is not None:
+                try:
+                    if self._spill_subdir is None:
+                        self._spill_subdir = tempfile.mkdtemp(prefix=u"Out-", dir=self.spill_dir)
+                    path = os.path.join(self._spill_subdir, u"{}.pickle".format(index))
+                    with io.open(path, "wb") as f:
+                        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    # Not every result can be pickled - those are simply dropped.
+                    pass
+                else:
+                    self._spilled[index] = path
+        
+        def _normalize_index(self, index):
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                raise IndexError(u"Out index out of range")
+            return index
+        
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                # Evicted results that are no longer available are left out.
+                return [self[i] for i in range(*index.indices(self._count)) if self.is_available(i)]
+            
+            index = self._normalize_index(index)
+            
+            try:
+                return self._entries[index][0]
+            except KeyError:
+                pass
+            
+            ref = self._weakrefs.get(index)
+            if ref is not None:
+                obj = ref()
+                if obj is not None:
+                    return obj
+            
+            path = self._spilled.get(index)
+            if path is not None:
+                with io.open(path, "rb") as f:
+                    return pickle.load(f)
+            
+            raise IndexError(u"Out[{}] was evicted from the output history".format(index))
+        
+        def is_available(self, index):
+            """Whether Out[index] can still be accessed."""
+            
+            index = self._normalize_index(index)
+            ref = self._weakrefs.get(index)
+            return index in self._entries or index in self._spilled or (ref is not None and ref() is not None)
+        
+        def __iter__(self):
+            for index in range(self._count):
+                if self.is_available(index):
+                    yield self[index]
+    
+    try:
+        clock = time.perf_counter
+    except AttributeError:
+        clock = time.time
+    
+    class BoundedRepr(reprlib.Repr):
+        """reprlib.Repr that also has a time limit and remembers whether anything was left out.
+        Dicts and sets are not sorted before their first items are taken, which the default implementation does. reprlib only knows the exact built-in types, and formats everything else using the full repr - subclasses of the containers (such as OrderedDict and Counter), bytes and bytearray are formatted by the bounded methods here instead."""
+        
+        CONTAINERS = (tuple, list, dict, set, frozenset, collections.deque)
+        SUBCLASS_BASES = CONTAINERS + (bytes, bytearray)
+        # Subclasses that define their own __repr__ are formatted using it, unless it is one of these standard ones.
+        STANDARD_REPRS = frozenset(cls.__repr__ for cls in SUBCLASS_BASES + (collections.OrderedDict, collections.defaultdict, collections.Counter))
+        
+        def __init__(self):
+            reprlib.Repr.__init__(self)
+            self.maxlevel = REPR_MAX_DEPTH
+            self.maxtuple = self.maxlist = self.maxarray = self.maxdict = self.maxset = self.maxfrozenset = self.maxdeque = REPR_MAX_ITEMS
+            self.maxstring = self.maxlong = self.maxother = REPR_MAX_LENGTH
+            self.truncated = False
+            self._deadline = None
+        
+        def repr(self, obj):
+            self.truncated = False
+            self._deadline = clock() + REPR_TIMEOUT
+            text = reprlib.Repr.repr(self, obj)
+            if len(text) > REPR_MAX_LENGTH:
+                self.truncated = True
+                text = text[:REPR_MAX_LENGTH] + u"..."
+            return text
+        
+        def repr1(self, x, level):
+            if clock() > self._deadline:
+                self.truncated = True
+                return u"..."
+            
+            if isinstance(x, self.CONTAINERS) and (len(x) > REPR_MAX_ITEMS or (level <= 0 and len(x) > 0)):
+                self.truncated = True
+            
+            # Same method name as the one that reprlib looks for.
+            typename = u"_".join(type(x).__name__.split())
+            if not hasattr(self, "repr_" + typename) and isinstance(x, self.SUBCLASS_BASES) and type(x).__repr__ in self.STANDARD_REPRS:
+                return type(x).__name__ + u"(" + self._repr_subclass_contents(x, level) + u")"
+            
+            return reprlib.Repr.repr1(self, x, level)
+        
+        def _repr_subclass_contents(self, x, level):
+            """Format the contents of an instance of a subclass of one of SUBCLASS_BASES like an instance of the base class."""
+            
+            if isinstance(x, dict):
+                return self.repr_dict(x, level)
+            elif isinstance(x, (set, frozenset)):
+                return self._repr_unsorted(x, level, u"{", u"}", self.maxset) if x else u""
+            elif isinstance(x, tuple):
+                return self.repr_tuple(x, level)
+            elif isinstance(x, (list, collections.deque)):
+                return self.repr_list(x, level)
+            else:
+                return self.repr_bytes(x, level)
+        
+        def repr_str(self, x, level):
+            if len(x) > self.maxstring:
+                self.truncated = True
+            return reprlib.Repr.repr_str(self, x, level)
+        
+        def repr_bytes(self, x, level):
+            # Only the start is passed to the built-in repr, so that huge data isn't formatted completely first.
+            if len(x) > self.maxstring:
+                self.truncated = True
+                return repr(bytes(x[:self.maxstring])) + u"..."
+            return repr(bytes(x))
+        
+        def repr_bytearray(self, x, level):
+            return u"bytearray(" + self.repr_bytes(x, level) + u")"
+        
+        def repr_instance(self, x, level):
+            text = reprlib.Repr.repr_instance(self, x, level)
+            # reprlib shortens long reprs of other objects to exactly maxother characters.
+            if len(text) >= self.maxother:
+                self.truncated = True
+            return text
+        
+        def repr_dict(self, x, level):
+            if not x:
+                return u"{}"
+            elif level <= 0:
+                return u"{...}"
+            
+            items = [u"{}: {}".format(self.repr1(key, level-1), self.repr1(value, level-1)) for key, value in itertools.islice(x.items(), self.maxdict)]
+            if len(x) > self.maxdict:
+                items.append(u"...")
+            return u"{" + u", ".join(items) + u"}"
+        
+        def _repr_unsorted(self, x, level, left, right, maxiter):
+            if level <= 0:
+                return left + u"..." + right
+            
+            items = [self.repr1(item, level-1) for item in itertools.islice(x, maxiter)]
+            if len(x) > maxiter:
+                items.append(u"...")
+            return left + u", ".join(items) + right
+        
+        def repr_set(self, x, level):
+            if not x:
+                return u"set()"
+            return self._repr_unsorted(x, level, u"{", u"}", self.maxset)
+        
+        def repr_frozenset(self, x, level):
+            if not x:
+                return u"frozenset()"
+            return self._repr_unsorted(x, level, u"frozenset({", u"})", self.maxfrozenset)
     
     def displayhook(obj):
         # Uncomment the next line if you want None to be "visible" like any other object.
@@ -67,115 +410,152 @@ def run():
         try:
             builtins.Out
         except AttributeError:
-            builtins.Out = []
+            builtins.Out = OutHistory()
         
         builtins._ = obj
         builtins.Out.append(obj)
-        console.set_color(0.0, 0.5, 0.0)
-        print(u"Out[{}]".format(len(builtins.Out)-1), end=u"")
-        console.set_color(0.2, 0.2, 0.2)
-        print(u" = ", end=u"")
-        console.set_color(0.33, 0.57, 1.0)
-        print(repr(obj))
-        console.set_color(0.2, 0.2, 0.2)
+        
+        out = StyledText()
+        out.write(COLOR_OUT, u"Out[{}]".format(len(builtins.Out)-1))
+        out.write(COLOR_TEXT, u" = ")
+        if REPR_BOUNDED:
+            bounded = BoundedRepr()
+            out.write(COLOR_RESULT, bounded.repr(obj) + u"\n")
+            if bounded.truncated:
+                out.write(COLOR_TEXT, u"(Output was shortened. Use print(repr(Out[{}])) to see all of it.)\n".format(len(builtins.Out)-1))
+        else:
+            out.write(COLOR_RESULT, repr(obj) + u"\n")
+        out.flush()
+        console.set_color(*COLOR_TEXT)
     
     sys.displayhook = displayhook
     
-    def _excepthook(exc_type, exc_value, exc_traceback):
-        console.set_color(0.75, 0.0, 0.0)
-        print(u"Traceback (most recent call last):")
+    def _excepthook(out, exc_type, exc_value, exc_traceback):
+        out.write(COLOR_ERROR, u"Traceback (most recent call last):\n")
         
-        for filename, lineno, funcname, text in traceback.extract_tb(exc_traceback):
-            
-            console.set_color(0.2, 0.2, 0.2)
-            print(u"\tFile ", end=u"")
-            console.set_color(0.81, 0.32, 0.29)
-            write_filename(filename)
+        # Each entry is [filename, line number, function name, frame globals, repeat count].
+        entries = []
+        tb = exc_traceback
+        while tb is not None:
+            code = tb.tb_frame.f_code
+            last = entries[-1] if entries else None
+            if last is not None and last[1] == tb.tb_lineno and last[2] == code.co_name and last[0] == code.co_filename:
+                last[4] += 1
+            else:
+                entries.append([code.co_filename, tb.tb_lineno, code.co_name, tb.tb_frame.f_globals, 0])
+            tb = tb.tb_next
+        
+        if TRACEBACK_HEAD is not None and TRACEBACK_TAIL is not None and len(entries) > TRACEBACK_HEAD + TRACEBACK_TAIL:
+            tail_start = len(entries) - TRACEBACK_TAIL
+            omitted = sum(entry[4] + 1 for entry in entries[TRACEBACK_HEAD:tail_start])
+            entries = entries[:TRACEBACK_HEAD] + [None] + entries[tail_start:]
+        
+        checked_files = set()
+        
+        for entry in entries:
+            if entry is None:
+                out.write(COLOR_TEXT, u"\t[{} more frames omitted]\n\n".format(omitted))
+                continue
             
-            console.set_color(0.2, 0.2, 0.2)
-            print(u", line ", end=u"")
-            console.set_color(0.15, 0.51, 0.84)
-            print(lineno, end=u"")
+            filename, lineno, funcname, frame_globals, repeated = entry
             
-            console.set_color(0.2, 0.2, 0.2)
-            print(u", in ", end=u"")
-            console.set_color(0.13, 0.46, 0.49)
-            print(funcname, end=u"")
+            if filename not in checked_files:
+                linecache.checkcache(filename)
+                checked_files.add(filename)
+            text = linecache.getline(filename, lineno, frame_globals).strip()
             
-            console.set_color(0.2, 0.2, 0.2)
-            print(u":")
+            out.write(COLOR_TEXT, u"\tFile ")
+            write_filename(out, filename)
+            out.write(COLOR_TEXT, u", line ")
+            out.write(COLOR_LINENO, u"{}".format(lineno))
+            out.write(COLOR_TEXT, u", in ")
+            out.write(COLOR_NAME, funcname)
+            out.write(COLOR_TEXT, u":\n")
             
-            console.set_color(0.2, 0.2, 0.2)
             if isinstance(text, bytes):
                 text = text.decode(u"utf-8", u"replace")
-            print(u"\t\t" + (text or u"# Source code unavailable"))
-            print()
+            out.write(COLOR_TEXT, u"\t\t" + (text or u"# Source code unavailable") + u"\n\n")
+            
+            if repeated:
+                out.write(COLOR_TEXT, u"\t[Previous frame repeated {} more time{}]\n\n".format(repeated, u"" if repeated == 1 else u"s"))
         
         if issubclass(exc_type, SyntaxError):
-            console.set_color(0.2, 0.2, 0.2)
-            print(u"\tFile ", end=u"")
-            console.set_color(0.81, 0.32, 0.29)
-            write_filename(exc_value.filename)
-            
-            console.set_color(0.2, 0.2, 0.2)
-            print(u", line ", end=u"")
-            console.set_color(0.15, 0.51, 0.84)
-            print(exc_value.lineno, end=u"")
-            
-            console.set_color(0.2, 0.2, 0.2)
-            print(u":")
+            out.write(COLOR_TEXT, u"\tFile ")
+            write_filename(out, exc_value.filename)
+            out.write(COLOR_TEXT, u", line ")
+            out.write(COLOR_LINENO, u"{}".format(exc_value.lineno))
+            out.write(COLOR_TEXT, u":\n")
             
             if exc_value.text is None:
-                console.set_color(0.75, 0.0, 0.0)
-                print(u"\t\t# Source code unavailable")
+                out.write(COLOR_ERROR, u"\t\t# Source code unavailable\n")
             else:
                 etext = exc_value.text
                 if isinstance(etext, bytes):
                     etext = etext.decode(u"utf-8", u"replace")
-                console.set_color(0.2, 0.2, 0.2)
-                print(u"\t\t" + etext[:exc_value.offset], end=u"")
-                console.set_color(0.75, 0.0, 0.0)
-                print(u"\N{COMBINING LOW LINE}" + etext[exc_value.offset:].rstrip())
-        
-        console.set_color(0.43, 0.25, 0.66)
-        print(exc_type.__module__, end=u"")
-        console.set_color(0.2, 0.2, 0.2)
-        print(u".", end=u"")
-        console.set_color(0.13, 0.46, 0.49)
-        print(getattr(exc_type, "__qualname__", exc_type.__name__), end=u"")
+                out.write(COLOR_TEXT, u"\t\t" + etext[:exc_value.offset])
+                out.write(COLOR_ERROR, u"\N{COMBINING LOW LINE}" + etext[exc_value.offset:].rstrip() + u"\n")
+        
+        out.write(COLOR_MODULE, exc_type.__module__)
+        out.write(COLOR_TEXT, u".")
+        out.write(COLOR_NAME, getattr(exc_type, "__qualname__", exc_type.__name__))
         
         msg = exc_value.msg if issubclass(exc_type, SyntaxError) else str(exc_value)
         
         if msg:
-            console.set_color(0.2, 0.2, 0.2)
-            print(u": ", end=u"")
-            console.set_color(0.75, 0.0, 0.0)
-            print(msg, end=u"")
+            out.write(COLOR_TEXT, u": ")
+            out.write(COLOR_ERROR, msg)
         
-        console.set_color(0.2, 0.2, 0.2)
-        print()
+        out.write(COLOR_TEXT, u"\n")
+    
+    def render_exception(out, exc_type, exc_value, exc_traceback):
+        # Collect the chain of causes and contexts first, from the newest exception to the oldest.
+        # Each exception is stored with the message that goes between it and the next newer exception.
+        chain = [(exc_type, exc_value, exc_traceback, None)]
+        seen = set([id(exc_value)])
+        current = exc_value
+        truncated = False
+        
+        while True:
+            # On Python 2, exceptions have no __cause__, __context__ or __supress_context__.
+            if getattr(current, "__cause__", None) is not None:
+                current = current.__cause__
+                message = u"\nThe above exception was the direct cause of the following exception:\n\n"
+            elif getattr(current, "__context__", None) is not None and not current.__suppress_context__:
+                current = current.__context__
+                message = u"\nDuring handling of the above exception, another exception occurred:\n\n"
+            else:
+                break
+            
+            if id(current) in seen:
+                # The chain loops back to an exception that is already in it.
+                break
+            elif len(chain) >= MAX_CHAINED_EXCEPTIONS:
+                truncated = True
+                break
+            
+            seen.add(id(current))
+            chain.append((type(current), current, current.__traceback__, message))
+        
+        if truncated:
+            out.write(COLOR_ERROR, u"[Earlier chained exceptions not shown]\n\n")
+        
+        for exc_type, exc_value, exc_traceback, message in reversed(chain):
+            _excepthook(out, exc_type, exc_value, exc_traceback)
+            if message is not None:
+                out.write(COLOR_ERROR, message)
     
     def excepthook(exc_type, exc_value, exc_traceback):
+        out = StyledText()
         try:
-            # On Python 2, exceptions have no __cause__, __context__ or __supress_context__.
-            if getattr(exc_value, "__cause__", None) is not None:
-                excepthook(exc_value.__cause__.__class__, exc_value.__cause__, exc_value.__cause__.__traceback__)
-                console.set_color(0.75, 0.0, 0.0)
-                print()
-                print(u"The above exception was the direct cause of the following exception:")
-                print()
-            elif getattr(exc_value, "__context__", None) is not None and not exc_value.__suppress_context__:
-                excepthook(exc_value.__context__.__class__, exc_value.__context__, exc_value.__context__.__traceback__)
-                console.set_color(0.75, 0.0, 0.0)
-                print()
-                print(u"During handling of the above exception, another exception occurred:")
-                print()
-            
-            _excepthook(exc_type, exc_value, exc_traceback)
+            try:
+                render_exception(out, exc_type, exc_value, exc_traceback)
+            finally:
+                # Write whatever was rendered, even if rendering failed partway.
+                out.flush()
         except Exception as err:
             traceback.print_exc()
         finally:
-            console.set_color(0.2, 0.2, 0.2)
+            console.set_color(*COLOR_TEXT)
     
     # sys.excepthook can't be customized, Pythonista overrides it on every script run.
     # So we need to override sys.__excepthook__ instead.
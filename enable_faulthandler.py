@@ -1,19 +1,30 @@
 """Enable Python's faulthandler.
 
 When you crash the app, a traceback is written into the faultlog folder and a warning message is displayed the next time you launch Pythonista.
+
+Whenever a new fault or stall log is saved, the oldest logs are deleted if there are more than MAX_LOGS, they take up more than MAX_LOGS_BYTES, or they are older than MAX_LOG_AGE_DAYS, and the remaining ones are gzipped, except for the new log and the newest fault log. Every crash is also recorded in faultlog-index.jsonl (one JSON object per line, with the time of the crash, the current log file name, size and the first line describing the error), so the past crashes can be listed by reading a single file.
+
+Optionally (see STALL_THRESHOLD), a watchdog also notices when the main (UI) thread hangs. A heartbeat thread keeps scheduling a tiny function on the main thread, and if the main thread hasn't run it for STALL_THRESHOLD seconds, the stacks of all Python threads are written into a stall-<timestamp>.txt file in the faultlog folder, which counts towards the same retention limits as the fault logs. A long hang produces only one report - the next one is only written after the main thread has responded again. This only works under Python 3, because it uses the faulthandler module.
 """
 
 from __future__ import absolute_import, division, print_function
 
+# Scheduling information for __init__.py: run() arms the process-wide crash handlers.
+DEPENDS_ON = ()
+MUTATES = ("faulthandler", "objc_setUncaughtExceptionHandler")
+
 def run():
     import ctypes
     import datetime
     import errno
+    import gzip
     import io
+    import json
     import objc_util
     import os
     import shutil
     import sys
+    import threading
     
     try:
         unicode
@@ -26,64 +37,237 @@ def run():
     LOGNAME_TEMPLATE = u"faultlog-{:%Y-%m-%d-%H-%M-%S}.txt"
     LOGNAME_DEFAULT = u"faultlog-temp.txt"
     EXCEPTIONLOGNAME_DEFAULT = u"exceptionlog-temp.txt"
+    STALLNAME_TEMPLATE = u"stall-{:%Y-%m-%d-%H-%M-%S}.txt"
+    INDEXNAME = u"faultlog-index.jsonl"
     
-    # Create the faultlog directory if necessary
-    try:
-        os.mkdir(LOGDIR)
-    except (IOError, OSError) as err:
-        if err.errno != errno.EEXIST:
-            raise
+    # Retention policy for saved fault logs. None disables the respective limit.
+    MAX_LOGS = 50
+    MAX_LOGS_BYTES = 10 * 1024 * 1024
+    MAX_LOG_AGE_DAYS = 180
+    # Whether to gzip the saved logs, except for the newest fault log and a stall log that was just written.
+    COMPRESS_LOGS = True
     
-    # Check whether an Objective-C exception log exists and append it to the fault log
-    try:
-        fin = io.open(os.path.join(LOGDIR, EXCEPTIONLOGNAME_DEFAULT), "rb")
-    except (IOError, OSError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-    else:
-        with fin:
-            data = fin.read()
-        
-        if data:
-            with io.open(os.path.join(LOGDIR, LOGNAME_DEFAULT), "ab") as fout:
-                # If the faultlog is not empty, add a separator
-                if fout.tell() != 0:
-                    fout.write(b"\n" + b"-"*72 + b"\n\n")
-                
-                fout.write(data)
+    # Number of seconds the main thread must be unresponsive before its stack is written to a stall log. None disables the stall watchdog.
+    STALL_THRESHOLD = None
+    # How often the watchdog checks on the main thread, in seconds.
+    STALL_CHECK_INTERVAL = 0.5
+    
+    def scan():
+        """Look at the faultlog directory once, creating it if necessary. Returns a dict mapping the names of the temporary logs that exist to their stat results."""
         
-        os.remove(os.path.join(LOGDIR, EXCEPTIONLOGNAME_DEFAULT))
+        found = {}
+        
+        try:
+            try:
+                scandir = os.scandir
+            except AttributeError:
+                # Python 2 has no scandir, so only the interesting names are stat-ed.
+                for name in os.listdir(LOGDIR):
+                    if name in (LOGNAME_DEFAULT, EXCEPTIONLOGNAME_DEFAULT):
+                        found[name] = os.stat(os.path.join(LOGDIR, name))
+            else:
+                for entry in scandir(LOGDIR):
+                    if entry.name in (LOGNAME_DEFAULT, EXCEPTIONLOGNAME_DEFAULT):
+                        found[entry.name] = entry.stat()
+        except (IOError, OSError) as err:
+            if err.errno != errno.ENOENT:
+                raise
+            os.mkdir(LOGDIR)
+        
+        return found
     
-    # Check whether a faultlog was written
-    did_fault = False
+    def summarize(path):
+        """Return the first line of the log that describes the error."""
+        
+        with io.open(path, "rb") as f:
+            lines = [line.strip() for line in f.read(16384).decode("utf-8", "replace").splitlines()]
+        lines = [line for line in lines if line]
+        
+        for line in lines:
+            if line.startswith(u"Fatal Python error"):
+                return line
+        
+        # Objective-C exception logs start with a header line, the next line has the exception name and reason.
+        if lines and lines[0].startswith(u"Objective-C exception details"):
+            lines = lines[1:]
+        
+        return lines[0] if lines else u""
     
-    try:
-        f = io.open(os.path.join(LOGDIR, LOGNAME_DEFAULT), "rb")
-    except (IOError, OSError) as err:
-        if err.errno != errno.ENOENT:
-            raise
-    else:
-        with f:
-            if f.read(1):
-                did_fault = True
+    def add_to_index(name, path, crash_time):
+        """Append an entry for a saved fault log to the index. crash_time is the modification time of the temporary log, which is when the crash was written - the saved log itself may have been changed since then."""
+        
+        entry = {
+            "time": datetime.datetime.fromtimestamp(crash_time).isoformat(),
+            "name": name,
+            "size": os.stat(path).st_size,
+            "summary": summarize(path),
+        }
+        
+        with io.open(os.path.join(LOGDIR, INDEXNAME), "ab") as f:
+            f.write(json.dumps(entry, sort_keys=True).encode("utf-8") + b"\n")
+    
+    # enforce_retention may be called from the log processing thread and the stall watchdog at the same time.
+    retention_lock = threading.Lock()
+    
+    def enforce_retention(newest_name):
+        """Delete the oldest saved fault and stall logs that don't fit the retention policy, and compress the remaining ones, except for newest_name and the newest fault log. The index is updated to match."""
+        
+        with retention_lock:
+            logs = []
+            for name in os.listdir(LOGDIR):
+                if (name.startswith(u"faultlog-") or name.startswith(u"stall-")) and name not in (LOGNAME_DEFAULT, INDEXNAME) and (name.endswith(u".txt") or name.endswith(u".txt.gz")):
+                    st = os.stat(os.path.join(LOGDIR, name))
+                    logs.append((st.st_mtime, name, st))
+            
+            # Newest first.
+            logs.sort(reverse=True)
+            
+            # The newest fault log is linked in the message printed at launch, so it is left as it is, even if a newer stall log was written since then.
+            newest_fault_name = next((name for mtime, name, st in logs if name.startswith(u"faultlog-")), None)
+            protected = set([newest_name, newest_fault_name])
+            
+            keep = set()
+            # Old name -> new name of every log that was compressed.
+            compressed = {}
+            total_size = 0
+            now = datetime.datetime.now()
+            
+            for mtime, name, st in logs:
+                path = os.path.join(LOGDIR, name)
+                
+                # Logs are deleted before they would be compressed, where possible. Only the size limit depends on the compressed sizes.
+                if name not in protected and (
+                    (MAX_LOGS is not None and len(keep) >= MAX_LOGS)
+                    or (MAX_LOGS_BYTES is not None and total_size > MAX_LOGS_BYTES)
+                    or (MAX_LOG_AGE_DAYS is not None and now - datetime.datetime.fromtimestamp(mtime) > datetime.timedelta(days=MAX_LOG_AGE_DAYS))
+                ):
+                    os.remove(path)
+                    continue
+                
+                if COMPRESS_LOGS and name.endswith(u".txt") and name not in protected:
+                    with io.open(path, "rb") as fin, gzip.open(path + u".gz", "wb") as fout:
+                        shutil.copyfileobj(fin, fout)
+                    # Keep the original modification time, it's used for the age limit.
+                    os.utime(path + u".gz", (st.st_atime, st.st_mtime))
+                    os.remove(path)
+                    compressed[name] = name + u".gz"
+                    name += u".gz"
+                    path += u".gz"
+                    st = os.stat(path)
+                
+                total_size += st.st_size
+                
+                if name in protected or MAX_LOGS_BYTES is None or total_size <= MAX_LOGS_BYTES:
+                    keep.add(name)
+                else:
+                    os.remove(path)
+            
+            if not compressed and len(keep) == len(logs):
+                return
+            
+            # Rename the index entries of compressed logs, and drop those of deleted logs.
+            index_path = os.path.join(LOGDIR, INDEXNAME)
+            try:
+                with io.open(index_path, "rb") as f:
+                    lines = f.read().splitlines()
+            except (IOError, OSError) as err:
+                if err.errno != errno.ENOENT:
+                    raise
+            else:
+                with io.open(index_path, "wb") as f:
+                    for line in lines:
+                        try:
+                            entry = json.loads(line.decode("utf-8"))
+                            name = compressed.get(entry["name"], entry["name"])
+                        except (ValueError, KeyError, TypeError):
+                            f.write(line + b"\n")
+                            continue
+                        
+                        if name not in keep:
+                            continue
+                        
+                        if name != entry["name"]:
+                            entry["name"] = name
+                            line = json.dumps(entry, sort_keys=True).encode("utf-8")
+                        
+                        f.write(line + b"\n")
     
-    # Notify the user that a crash has happened
-    if did_fault:
+    def merge_and_save_logs(stamped_name, crash_time, exception_stat):
+        """Merge the Objective-C exception log into the fault log, tell the user about the crash and apply the retention policy."""
+        
+        if exception_stat is not None:
+            exception_path = os.path.join(LOGDIR, EXCEPTIONLOGNAME_DEFAULT)
+            
+            # The exception log was seen by scan(), but it may have been removed since then, e. g. by a second Python version starting at the same time.
+            try:
+                with io.open(exception_path, "rb") as fin:
+                    data = fin.read()
+            except (IOError, OSError) as err:
+                if err.errno != errno.ENOENT:
+                    raise
+                data = b""
+            
+            if data:
+                if stamped_name is None:
+                    crash_time = exception_stat.st_mtime
+                    stamped_name = LOGNAME_TEMPLATE.format(datetime.datetime.fromtimestamp(crash_time))
+                
+                with io.open(os.path.join(LOGDIR, stamped_name), "ab") as fout:
+                    # If the faultlog is not empty, add a separator
+                    if fout.tell() != 0:
+                        fout.write(b"\n" + b"-"*72 + b"\n\n")
+                    
+                    fout.write(data)
+            
+            try:
+                os.remove(exception_path)
+            except (IOError, OSError) as err:
+                if err.errno != errno.ENOENT:
+                    raise
+        
+        if stamped_name is None:
+            return
+        
+        # Notify the user that a crash has happened
         import console
         try:
             from urllib.parse import quote
         except ImportError:
             from urllib import quote
         
-        print(u"Pythonista quit abnormally last time.", file=sys.stderr)
-        
-        default_path = os.path.join(LOGDIR, LOGNAME_DEFAULT)
-        stamped_name = LOGNAME_TEMPLATE.format(datetime.datetime.fromtimestamp(os.stat(default_path).st_mtime))
         stamped_path = os.path.join(LOGDIR, stamped_name)
-        shutil.move(default_path, stamped_path)
+        
+        print(u"Pythonista quit abnormally last time.", file=sys.stderr)
         print(u"For details, see the following log file: ", file=sys.stderr, end=u"")
         console.write_link(stamped_name, "file://" + quote(stamped_path))
         print(file=sys.stderr)
+        
+        add_to_index(stamped_name, stamped_path, crash_time)
+        enforce_retention(stamped_name)
+    
+    def process_logs(stamped_name, crash_time, exception_stat):
+        """Run merge_and_save_logs in the background, after the handlers have been armed. An exception on this thread would otherwise go unnoticed, so it is printed with a clear prefix."""
+        
+        try:
+            merge_and_save_logs(stamped_name, crash_time, exception_stat)
+        except Exception:
+            import traceback
+            print(u"Exception while processing the fault logs:", file=sys.stderr)
+            traceback.print_exc()
+    
+    # A normal launch only needs this one look at the directory. Everything else is only done if a crash has happened.
+    found = scan()
+    
+    # The fault log must be moved out of the way before the fault handler is armed, which truncates it. A rename is cheap, the rest of the work is done later.
+    stamped_name = None
+    crash_time = None
+    fault_stat = found.get(LOGNAME_DEFAULT)
+    if fault_stat is not None and fault_stat.st_size:
+        crash_time = fault_stat.st_mtime
+        stamped_name = LOGNAME_TEMPLATE.format(datetime.datetime.fromtimestamp(fault_stat.st_mtime))
+        os.rename(os.path.join(LOGDIR, LOGNAME_DEFAULT), os.path.join(LOGDIR, stamped_name))
+    
+    exception_stat = found.get(EXCEPTIONLOGNAME_DEFAULT)
     
     if sys.version_info < (3,):
         print(u"Setting exception handler.")
@@ -144,6 +328,55 @@ def run():
         
         logfile = io.open(os.path.join(LOGDIR, LOGNAME_DEFAULT), "wb")
         faulthandler.enable(logfile)
+        
+        if STALL_THRESHOLD is not None:
+            print(u"Starting stall watchdog.")
+            
+            import time
+            
+            last_tick = [time.monotonic()]
+            
+            @objc_util.on_main_thread
+            def tick():
+                last_tick[0] = time.monotonic()
+            
+            def heartbeat():
+                while True:
+                    # If the main thread hangs, this call blocks as well, and the last tick gets older and older.
+                    tick()
+                    time.sleep(STALL_CHECK_INTERVAL)
+            
+            def watchdog():
+                reported = False
+                
+                while True:
+                    time.sleep(STALL_CHECK_INTERVAL)
+                    stalled = time.monotonic() - last_tick[0]
+                    
+                    if stalled < STALL_THRESHOLD:
+                        reported = False
+                    elif not reported:
+                        reported = True
+                        stall_name = STALLNAME_TEMPLATE.format(datetime.datetime.now())
+                        try:
+                            with io.open(os.path.join(LOGDIR, stall_name), "w") as f:
+                                f.write(u"The main thread has not responded for {:.1f} seconds.\n\n".format(stalled))
+                                f.flush()
+                                faulthandler.dump_traceback(f, all_threads=True)
+                            
+                            enforce_retention(stall_name)
+                        except (IOError, OSError):
+                            pass
+            
+            for target in (heartbeat, watchdog):
+                thread = threading.Thread(target=target, name="stall watchdog " + target.__name__)
+                thread.daemon = True
+                thread.start()
+    
+    if stamped_name is not None or exception_stat is not None:
+        thread = threading.Thread(target=process_logs, args=(stamped_name, crash_time, exception_stat), name="fault log processing")
+        thread.daemon = True
+        thread.start()
     
     print(u"Done enabling fault handler and Objective-C exception handler.")
 
@@ -5,15 +5,40 @@ Some scripts meant for "normal computers" require these methods to exist and ret
 The file descriptors returned by fileno are of course not real. Actually, they are *too* real - they belong to the real standard streams, which go nowhere on iOS.
 
 isatty returns False, because the Pythonista console is not a terminal emulator. If you make it return True, scripts may start writing out ANSI escape codes for output formatting and cursor control. Pythonista doesn't support these, so they are printed out literally, which is ugly. Although some scripts also assume that *only* TTYs are interactive, or require the standard streams to be TTYs, so there are valid reasons to make them return True.
+
+Optionally (see BUFFER_MODE), sys.stdout and sys.stderr are also replaced with buffered wrappers. Pythonista's console is slow at handling many small writes, so scripts that print a lot spend most of their time waiting for it. The wrappers collect the output in memory and pass it on to the console in larger pieces - at the end of every line ("line" mode) or only when the buffer is full ("block" mode), and in both modes on flush() and at the latest FLUSH_INTERVAL seconds after the first buffered write. Both wrappers share one buffer, so output written to stdout and stderr still appears in the order it was written. The console module functions that write to the console directly (such as set_color and write_link) flush the buffer first, for the same reason.
+
+Under Python 3, the standard streams also get a buffer attribute, like the streams of a normal Python process, for scripts that read or write bytes. Bytes written to sys.stdout.buffer or sys.stderr.buffer (bytes, bytearray, memoryview or anything else that supports the buffer protocol) are decoded as UTF-8 and written to the text stream, directly from the caller's buffer. A UTF-8 sequence split across two writes is decoded correctly (only then are the written bytes copied, to join them with the start of the sequence). sys.stdin.buffer returns the console input encoded as UTF-8, and supports readinto, which copies the input directly into the caller's buffer. Like a pipe, readinto and read(size) return as soon as some input is available (normally one line), instead of waiting until size bytes have been entered.
 """
 
 from __future__ import absolute_import, division, print_function
 
+# run() patches the classes of all three standard streams (and optionally replaces sys.stdout and sys.stderr), so __init__.py runs it alone.
+DEPENDS_ON = ()
+MUTATES = ("sys.stdin", "sys.stdout", "sys.stderr", "console")
+
 def run():
+    import codecs
     import sys
+    import threading
+    import time
+    
+    try:
+        monotonic = time.monotonic
+    except AttributeError:
+        monotonic = time.time
     
     print(u"Patching standard stream objects...")
     
+    # How output to sys.stdout and sys.stderr is buffered: None (not at all, every write goes to the console immediately), "line" or "block".
+    BUFFER_MODE = None
+    # Number of buffered characters after which the buffer is flushed in any mode.
+    BUFFER_SIZE = 8192
+    # Maximum time in seconds that output stays in the buffer.
+    FLUSH_INTERVAL = 0.05
+    # console functions that write to the console directly, and so must not overtake the buffered output.
+    CONSOLE_FUNCTIONS = ("clear", "set_color", "set_font", "write_link")
+    
     def make_isatty(isit):
         def isatty(self):
             return isit
@@ -33,6 +58,246 @@ def run():
     sys.stderr.__class__.fileno = make_fileno(2)
     sys.stderr.__class__.isatty = make_isatty(False)
     
+    class ConsoleBinaryWriter(object):
+        """Binary layer on top of an output text stream. Written bytes are decoded as UTF-8 and written to the text stream."""
+        
+        def __init__(self, stream):
+            self._stream = stream
+            # Start of a UTF-8 sequence at the end of the last write, which is completed by the next write.
+            self._partial = b""
+        
+        def __getattr__(self, name):
+            return getattr(self._stream, name)
+        
+        def readable(self):
+            return False
+        
+        def writable(self):
+            return True
+        
+        def write(self, data):
+            # Bytes, so that slicing counts bytes for buffers with larger items (e.g. arrays of ints).
+            view = memoryview(data).cast("B")
+            count = view.nbytes
+            # Decoding directly from the memoryview avoids copying the data into a bytes object first (which an incremental decoder always does). Only a write that completes a split sequence is copied, to join the two parts.
+            if self._partial:
+                view = self._partial + view.tobytes()
+            text, consumed = codecs.utf_8_decode(view, "replace", False)
+            self._partial = bytes(view[consumed:])
+            if text:
+                self._stream.write(text)
+            return count
+        
+        def writelines(self, lines):
+            self.write(b"".join(lines))
+        
+        def flush(self):
+            self._stream.flush()
+    
+    class ConsoleBinaryReader(object):
+        """Binary layer on top of the input text stream. Input is read one line at a time and encoded as UTF-8."""
+        
+        def __init__(self, stream):
+            self._stream = stream
+            self._pending = b""
+            self._pos = 0
+        
+        def __getattr__(self, name):
+            return getattr(self._stream, name)
+        
+        def readable(self):
+            return True
+        
+        def writable(self):
+            return False
+        
+        def _fill(self):
+            """Make sure that some input is pending, unless the end of the input was reached. Returns the number of pending bytes."""
+            
+            if self._pos >= len(self._pending):
+                self._pending = self._stream.readline().encode("utf-8")
+                self._pos = 0
+            return len(self._pending) - self._pos
+        
+        def readinto(self, buffer):
+            view = memoryview(buffer).cast("B")
+            count = min(len(view), self._fill())
+            view[:count] = memoryview(self._pending)[self._pos:self._pos + count]
+            self._pos += count
+            return count
+        
+        readinto1 = readinto
+        
+        def read(self, size=-1):
+            if size is None or size < 0:
+                chunks = []
+                while self._fill():
+                    chunks.append(self._pending[self._pos:])
+                    self._pos = len(self._pending)
+                return b"".join(chunks)
+            
+            if size == 0:
+                return b""
+            
+            buffer = bytearray(size)
+            return bytes(buffer[:self.readinto(buffer)])
+        
+        read1 = read
+        
+        def readline(self, size=-1):
+            if not self._fill():
+                return b""
+            
+            end = self._pending.find(b"\n", self._pos) + 1 or len(self._pending)
+            if size is not None and size >= 0:
+                end = min(end, self._pos + size)
+            
+            line = self._pending[self._pos:end]
+            self._pos = end
+            return line
+        
+        def readlines(self, hint=-1):
+            return list(iter(self.readline, b""))
+        
+        def __iter__(self):
+            return iter(self.readline, b"")
+    
+    def make_buffer(factory):
+        # One binary layer per stream, created when it is first used.
+        binary_streams = {}
+        
+        def buffer(self):
+            try:
+                return binary_streams[id(self)]
+            except KeyError:
+                return binary_streams.setdefault(id(self), factory(self))
+        
+        return property(buffer)
+    
+    if sys.version_info >= (3,):
+        for stream, factory in ((sys.stdin, ConsoleBinaryReader), (sys.stdout, ConsoleBinaryWriter), (sys.stderr, ConsoleBinaryWriter)):
+            # Don't replace a real buffer attribute, or one that was added by an earlier run.
+            if not hasattr(stream.__class__, "buffer"):
+                stream.__class__.buffer = make_buffer(factory)
+    
+    class ConsoleBuffer(object):
+        """Output waiting to be written to the console, shared by all buffered streams."""
+        
+        def __init__(self, size, interval):
+            self.size = size
+            self.interval = interval
+            self._lock = threading.RLock()
+            # Used to wake up the flusher thread when it is idle and output is written.
+            self._wakeup = threading.Condition(self._lock)
+            # List of [stream, list of strings]. Consecutive writes to the same stream are collected in the same entry.
+            self._chunks = []
+            self._length = 0
+            # Time of the first write since the last flush, or None if the buffer is empty.
+            self._since = None
+            self._flusher = None
+            self._flusher_idle = False
+        
+        def write(self, stream, text, flush):
+            with self._lock:
+                if self._chunks and self._chunks[-1][0] is stream:
+                    self._chunks[-1][1].append(text)
+                else:
+                    self._chunks.append([stream, [text]])
+                self._length += len(text)
+                
+                if flush or self._length >= self.size:
+                    self.flush()
+                elif self._since is None:
+                    self._since = monotonic()
+                    if self._flusher is None:
+                        self._flusher = threading.Thread(target=self._run_flusher, name="console buffer flusher")
+                        self._flusher.daemon = True
+                        self._flusher.start()
+                    elif self._flusher_idle:
+                        self._wakeup.notify()
+        
+        def _run_flusher(self):
+            """Flush output that has been in the buffer for interval seconds. Runs forever on one thread, which only has to be woken up by write after the buffer has been empty for a whole interval - a new thread or wakeup per line would cost more than the console writes that the buffer saves."""
+            
+            with self._lock:
+                while True:
+                    if self._since is None:
+                        self._wakeup.wait(self.interval)
+                        if self._since is None:
+                            self._flusher_idle = True
+                            self._wakeup.wait()
+                            self._flusher_idle = False
+                    else:
+                        remaining = self._since + self.interval - monotonic()
+                        if remaining > 0:
+                            self._wakeup.wait(remaining)
+                        else:
+                            self.flush()
+        
+        def flush(self):
+            with self._lock:
+                chunks = self._chunks
+                self._chunks = []
+                self._length = 0
+                self._since = None
+                
+                # The lock is held while writing, so a concurrent write can't overtake this output.
+                for stream, parts in chunks:
+                    stream.write("".join(parts))
+    
+    class BufferedConsoleStream(object):
+        """Wrapper around one of Pythonista's output streams that writes through a ConsoleBuffer. Everything except writing is forwarded to the original stream."""
+        
+        def __init__(self, stream, console_buffer, line_buffering):
+            self._stream = stream
+            self.console_buffer = console_buffer
+            self.line_buffering = line_buffering
+        
+        def __getattr__(self, name):
+            return getattr(self._stream, name)
+        
+        def write(self, text):
+            if text:
+                self.console_buffer.write(self._stream, text, self.line_buffering and "\n" in text)
+            return len(text)
+        
+        def writelines(self, lines):
+            # One buffer operation for all lines, instead of one per line.
+            self.write("".join(lines))
+        
+        def flush(self):
+            self.console_buffer.flush()
+        
+        if sys.version_info >= (3,):
+            # Binary output must go through the buffer as well, so it keeps its place relative to text output.
+            buffer = make_buffer(ConsoleBinaryWriter)
+    
+    def make_flushing(func, console_buffer):
+        def flushing(*args, **kwargs):
+            console_buffer.flush()
+            return func(*args, **kwargs)
+        
+        flushing.__name__ = func.__name__
+        flushing.__doc__ = func.__doc__
+        flushing.unbuffered = func
+        return flushing
+    
+    # Don't wrap the streams again if this module is run more than once.
+    if BUFFER_MODE is not None and getattr(sys.stdout, "console_buffer", None) is None:
+        import atexit
+        import console
+        
+        console_buffer = ConsoleBuffer(BUFFER_SIZE, FLUSH_INTERVAL)
+        sys.stdout = BufferedConsoleStream(sys.stdout, console_buffer, BUFFER_MODE == "line")
+        sys.stderr = BufferedConsoleStream(sys.stderr, console_buffer, BUFFER_MODE == "line")
+        
+        for name in CONSOLE_FUNCTIONS:
+            func = getattr(console, name, None)
+            if func is not None:
+                setattr(console, name, make_flushing(getattr(func, "unbuffered", func), console_buffer))
+        
+        atexit.register(console_buffer.flush)
+    
     print(u"Done patching standard stream objects.")
 
 if __name__ == "__main__":
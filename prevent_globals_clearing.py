@@ -0,0 +1,51 @@
+"""Prevent Pythonista from clearing the globals that were set up by pythonista_startup.
+
+Before running a script, Pythonista deletes all names from __main__ that were not there when pythonista_startup finished. To find out which names those were, it calls dir() on the pythonista_startup module. run() replaces that module with one whose dir() returns the names in __main__ instead, so nothing is ever considered new, and nothing is deleted.
+
+dir() is called repeatedly by the preflight and autocompletion, so under Python 3 the sorted list of names is cached, and only rebuilt when names were added to or removed from __main__. This is detected by comparing the current names with a set of the names that the list was built from, which still takes time proportional to the number of names, but avoids sorting them again. Under Python 2 the list is always rebuilt.
+
+run() must be called at the very end of pythonista_startup - anything that is added to the module afterwards is not visible in the replacement module.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# Scheduling information for __init__.py. This module is not in SUBMODULES, because it has to run after everything else.
+DEPENDS_ON = ()
+MUTATES = ("sys.modules",)
+
+def run():
+    import sys
+    import types
+    
+    print(u"Preventing globals clearing...")
+    
+    class DirAllTheGlobals(types.ModuleType):
+        import __main__
+        
+        # (frozenset of names, sorted names), for the last state of __main__ that was looked at.
+        _dir_cache = (frozenset(), [])
+        
+        if sys.version_info >= (3,):
+            def __dir__(self):
+                names = vars(type(self).__main__)
+                
+                cached_names, cached_dir = type(self)._dir_cache
+                if names.keys() != cached_names:
+                    cached_dir = sorted(names)
+                    type(self)._dir_cache = (frozenset(cached_dir), cached_dir)
+                
+                # dir() sorts (and so copies) the returned list, which is fast because it is already sorted. The cached list itself is never changed by the caller.
+                return cached_dir
+        else:
+            def __dir__(self):
+                return dir(type(self).__main__)
+    
+    old_module = sys.modules["pythonista_startup"]
+    new_module = DirAllTheGlobals(old_module.__name__, old_module.__doc__)
+    vars(new_module).update(vars(old_module))
+    sys.modules["pythonista_startup"] = new_module
+    
+    print(u"Done preventing globals clearing.")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,212 @@
+"""Import time profiler, similar to python -X importtime, but usable inside Pythonista, where there is no way to pass command line options.
+
+run() adds an object named import_profiler to the builtins. It can be used like this:
+
+    import_profiler.start()
+    import some_slow_module
+    import_profiler.stop()
+
+Or as a context manager (with import_profiler: ...), or to profile an entire script with import_profiler.run_script(path).
+
+While the profiler is active, builtins.__import__ is wrapped, and the self and cumulative time of every import that loaded new modules is recorded, nested like the imports themselves. Each import is named after the modules that it loaded, so that for example "from . import sub" is recorded as pkg.sub, and not as pkg. When the profiler is stopped, the slowest imports are printed, and two files are written into the profilelog folder in Documents: a report in the same format as -X importtime, and a collapsed stack file that can be turned into a flame graph (e.g. using flamegraph.pl or speedscope).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# run() only adds import_profiler to the builtins. builtins.__import__ is only replaced while the profiler is active.
+DEPENDS_ON = ()
+MUTATES = ("builtins.import_profiler",)
+
+def run():
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    import datetime
+    import errno
+    import io
+    import os
+    import sys
+    import threading
+    import time
+    
+    print(u"Installing import profiler...")
+    
+    LOGDIR = os.path.expanduser(u"~/Documents/profilelog")
+    LOGNAME_TEMPLATE = u"importtime-{:%Y-%m-%d-%H-%M-%S}"
+    # Number of imports to print when the profiler is stopped.
+    REPORT_TOP = 20
+    
+    try:
+        clock = time.perf_counter
+    except AttributeError:
+        clock = time.time
+    
+    def absolute_name(name, globals, level):
+        """Resolve a relative import the same way the import system does, for display purposes."""
+        
+        if level <= 0 or not globals:
+            return name
+        
+        package = globals.get("__package__")
+        if not package:
+            package = globals.get("__name__", u"")
+            if "__path__" not in globals:
+                package = package.rpartition(".")[0]
+        
+        base = package.rsplit(".", level - 1)[0]
+        return base + "." + name if name else base
+    
+    class ImportProfiler(object):
+        def __init__(self):
+            self._real_import = None
+            self._state = threading.local()
+            self._lock = threading.Lock()
+            # (tuple of the stack entries of the enclosing imports and this one, self time, cumulative time), in the order the imports finished.
+            # The entries are kept instead of their names, because the name of an import is only known once it is done, after the nested imports were recorded.
+            self.records = []
+        
+        @property
+        def active(self):
+            return self._real_import is not None
+        
+        def _make_import(self):
+            real_import = self._real_import
+            state = self._state
+            records = self.records
+            lock = self._lock
+            
+            def __import__(name, globals=None, locals=None, fromlist=(), level=0 if sys.version_info >= (3,) else -1):
+                stack = getattr(state, "stack", None)
+                if stack is None:
+                    stack = state.stack = []
+                
+                # Each stack entry is [name, time spent in nested imports, names of the modules loaded by nested imports].
+                entry = [absolute_name(name, globals, level), 0.0, set()]
+                stack.append(entry)
+                module_count = len(sys.modules)
+                # Which of the requested modules are not loaded yet. The modules that an import actually loads are found by checking these afterwards, instead of comparing all of sys.modules.
+                was_loaded = entry[0] in sys.modules
+                missing_from = [item for item in fromlist or () if item != "*" and entry[0] + "." + item not in sys.modules]
+                start = clock()
+                try:
+                    return real_import(name, globals, locals, fromlist, level)
+                finally:
+                    elapsed = clock() - start
+                    stack.pop()
+                    
+                    # Imports of modules that were already loaded are not interesting, and only add noise.
+                    if len(sys.modules) != module_count:
+                        loaded = [entry[0] + "." + item for item in missing_from if entry[0] + "." + item in sys.modules]
+                        if not was_loaded and entry[0] in sys.modules:
+                            loaded.insert(0, entry[0])
+                        # Modules that were loaded by a nested import already have their own record.
+                        loaded = [modname for modname in loaded if modname not in entry[2]] or loaded
+                        if loaded:
+                            entry[0] = u", ".join(loaded)
+                        
+                        if stack:
+                            stack[-1][1] += elapsed
+                            stack[-1][2].update(entry[2])
+                            stack[-1][2].update(loaded)
+                        with lock:
+                            records.append((tuple(stack) + (entry,), elapsed - entry[1], elapsed))
+            
+            __import__.import_profiler = self
+            return __import__
+        
+        def start(self):
+            """Start recording imports. Records from earlier runs are discarded."""
+            
+            if self.active:
+                return
+            
+            del self.records[:]
+            self._real_import = builtins.__import__
+            builtins.__import__ = self._make_import()
+        
+        def stop(self, report=True):
+            """Stop recording imports, and unless report is false, print and write the report files."""
+            
+            if not self.active:
+                return
+            
+            # If another hook was installed on top of the profiler in the meantime, it can't be removed without also removing that hook.
+            if getattr(builtins.__import__, "import_profiler", None) is self:
+                builtins.__import__ = self._real_import
+            self._real_import = None
+            
+            if report:
+                self.report()
+                self.dump()
+        
+        def __enter__(self):
+            self.start()
+            return self
+        
+        def __exit__(self, exc_type, exc_value, exc_traceback):
+            self.stop()
+        
+        def run_script(self, path):
+            """Run the script at path (like runpy.run_path) while profiling its imports."""
+            
+            import runpy
+            
+            with self:
+                return runpy.run_path(os.path.expanduser(path), run_name="__main__")
+        
+        def _named_records(self):
+            """Return the records with the names of the imports instead of their stack entries."""
+            
+            with self._lock:
+                return [(tuple(item[0] for item in entries), self_time, cumulative) for entries, self_time, cumulative in self.records]
+        
+        def report(self, top=REPORT_TOP):
+            """Print the imports with the highest cumulative time."""
+            
+            records = self._named_records()
+            
+            print(u"Slowest imports (cumulative / self):")
+            for names, self_time, cumulative in sorted(records, key=lambda record: record[2], reverse=True)[:top]:
+                print(u"\t{:8.2f} ms / {:8.2f} ms  {}".format(cumulative * 1000.0, self_time * 1000.0, names[-1]))
+            print(u"\t{:8.2f} ms in total for {} imports".format(sum(record[2] for record in records if len(record[0]) == 1) * 1000.0, len(records)))
+        
+        def dump(self):
+            """Write the report and collapsed stack files. Returns the paths of both files."""
+            
+            try:
+                os.mkdir(LOGDIR)
+            except (IOError, OSError) as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            
+            records = self._named_records()
+            
+            basepath = os.path.join(LOGDIR, LOGNAME_TEMPLATE.format(datetime.datetime.now()))
+            
+            # Same layout as the output of python -X importtime.
+            with io.open(basepath + u".txt", "w", encoding="utf-8") as f:
+                f.write(u"import time: self [us] | cumulative | imported package\n")
+                for names, self_time, cumulative in records:
+                    f.write(u"import time: {:>9} | {:>10} | {}{}\n".format(int(self_time * 1e6), int(cumulative * 1e6), u"  " * (len(names) - 1), names[-1]))
+            
+            # One line per distinct import stack, with its total self time in microseconds.
+            folded = {}
+            for names, self_time, cumulative in records:
+                folded[names] = folded.get(names, 0.0) + self_time
+            
+            with io.open(basepath + u".folded", "w", encoding="utf-8") as f:
+                for names, self_time in sorted(folded.items()):
+                    f.write(u"{} {}\n".format(u";".join(names), int(self_time * 1e6)))
+            
+            print(u"Wrote import profile to {}.txt and .folded".format(basepath))
+            return basepath + u".txt", basepath + u".folded"
+    
+    # Don't replace a profiler that is currently running.
+    if not getattr(getattr(builtins, "import_profiler", None), "active", False):
+        builtins.import_profiler = ImportProfiler()
+    
+    print(u"Done installing import profiler.")
+
+if __name__ == "__main__":
+    run()
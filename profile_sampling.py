@@ -0,0 +1,177 @@
+"""Low-overhead sampling CPU profiler, for finding out where a slow script spends its time without the large slowdown of cProfile.
+
+run() adds an object named sampling_profiler to the builtins. It can be used like this:
+
+    sampling_profiler.start()
+    some_slow_function()
+    sampling_profiler.stop()
+
+Or as a context manager (with sampling_profiler: ...), or to profile an entire script with sampling_profiler.run_script(path).
+
+While the profiler is active, a background thread looks at the stacks of all other threads (using sys._current_frames) every SAMPLE_INTERVAL seconds, and counts how often each stack was seen. The profiled code itself is not slowed down at all, except for sharing the GIL with the sampling thread. When the profiler is stopped, the functions that were seen most often are printed, and a collapsed stack file is written into the profilelog folder in Documents, which can be turned into a flame graph (e.g. using flamegraph.pl or speedscope).
+"""
+
+from __future__ import absolute_import, division, print_function
+
+# run() only adds sampling_profiler to the builtins.
+DEPENDS_ON = ()
+MUTATES = ("builtins.sampling_profiler",)
+
+def run():
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    import datetime
+    import errno
+    import io
+    import os
+    import sys
+    import threading
+    
+    print(u"Installing sampling profiler...")
+    
+    LOGDIR = os.path.expanduser(u"~/Documents/profilelog")
+    LOGNAME_TEMPLATE = u"cpu-{:%Y-%m-%d-%H-%M-%S}.folded"
+    # Default time between two samples, in seconds.
+    SAMPLE_INTERVAL = 0.005
+    # Number of functions to print when the profiler is stopped.
+    REPORT_TOP = 20
+    
+    class SamplingProfiler(object):
+        def __init__(self):
+            self._thread = None
+            self._stop = threading.Event()
+            # Code object -> label. Every frame of the same function shares the same label string, so the stack tuples stay small.
+            self._labels = {}
+            # Tuple of labels, outermost first -> number of samples in which the stack was seen.
+            self.counts = {}
+            self.samples = 0
+        
+        @property
+        def active(self):
+            return self._thread is not None
+        
+        def _label(self, code):
+            try:
+                return self._labels[code]
+            except KeyError:
+                label = self._labels[code] = u"{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+                return label
+        
+        def _sample_loop(self, interval):
+            own_ident = threading.current_thread().ident
+            thread_names = {}
+            counts = self.counts
+            label = self._label
+            
+            while not self._stop.wait(interval):
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_ident:
+                        continue
+                    
+                    try:
+                        thread_name = thread_names[ident]
+                    except KeyError:
+                        thread_names.update((thread.ident, u"thread " + thread.name) for thread in threading.enumerate())
+                        thread_name = thread_names.setdefault(ident, u"thread {}".format(ident))
+                    
+                    stack = []
+                    while frame is not None:
+                        stack.append(label(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(thread_name)
+                    stack.reverse()
+                    
+                    stack = tuple(stack)
+                    counts[stack] = counts.get(stack, 0) + 1
+                
+                self.samples += 1
+        
+        def start(self, interval=SAMPLE_INTERVAL):
+            """Start sampling every interval seconds. Samples from earlier runs are discarded."""
+            
+            if self.active:
+                return
+            
+            self.counts.clear()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample_loop, args=(interval,), name="sampling profiler")
+            self._thread.daemon = True
+            self._thread.start()
+        
+        def stop(self, report=True):
+            """Stop sampling, and unless report is false, print the report and write the collapsed stack file."""
+            
+            if not self.active:
+                return
+            
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            
+            if report:
+                self.report()
+                self.dump()
+        
+        def __enter__(self):
+            self.start()
+            return self
+        
+        def __exit__(self, exc_type, exc_value, exc_traceback):
+            self.stop()
+        
+        def run_script(self, path, interval=SAMPLE_INTERVAL):
+            """Run the script at path (like runpy.run_path) while sampling it."""
+            
+            import runpy
+            
+            self.start(interval)
+            try:
+                return runpy.run_path(os.path.expanduser(path), run_name="__main__")
+            finally:
+                self.stop()
+        
+        def report(self, top=REPORT_TOP):
+            """Print the functions that were on top of the stack most often, and how often they were on the stack at all."""
+            
+            own = {}
+            total = {}
+            for stack, count in list(self.counts.items()):
+                own[stack[-1]] = own.get(stack[-1], 0) + count
+                # A recursive function is counted only once per sample.
+                for label in set(stack[1:]):
+                    total[label] = total.get(label, 0) + count
+            
+            samples = max(sum(own.values()), 1)
+            print(u"Hottest functions (own samples / total samples, out of {}):".format(samples))
+            for label, count in sorted(own.items(), key=lambda item: item[1], reverse=True)[:top]:
+                print(u"\t{:6.1f}% / {:6.1f}%  {}".format(100.0 * count / samples, 100.0 * total.get(label, count) / samples, label))
+        
+        def dump(self):
+            """Write the collapsed stack file. Returns its path."""
+            
+            try:
+                os.mkdir(LOGDIR)
+            except (IOError, OSError) as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            
+            path = os.path.join(LOGDIR, LOGNAME_TEMPLATE.format(datetime.datetime.now()))
+            with io.open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(self.counts.items()):
+                    # Semicolons separate the frames in this format, so they can't appear in the labels.
+                    f.write(u";".join(label.replace(u";", u":") for label in stack) + u" {}\n".format(count))
+            
+            print(u"Wrote CPU profile to {}".format(path))
+            return path
+    
+    # Don't replace a profiler that is currently running.
+    if not getattr(getattr(builtins, "sampling_profiler", None), "active", False):
+        builtins.sampling_profiler = SamplingProfiler()
+    
+    print(u"Done installing sampling profiler.")
+
+if __name__ == "__main__":
+    run()
@@ -1,63 +1,323 @@
-"""This little thing walks through the entire type hierarchy, starting at object, and assigns all type objects to their "owner" modules based on their __module__ and __name__ attributes. Especially the __builtin__/builtins module has many "hidden" types that can only be accessed indirectly. Some of these are useful (like instancemethod), some are interesting to play around with (like code), and most are useless (like the many iterator types)."""
+"""This little thing walks through the entire type hierarchy, starting at object, and assigns all type objects to their "owner" modules based on their __module__ and __name__ attributes. Especially the __builtin__/builtins module has many "hidden" types that can only be accessed indirectly. Some of these are useful (like instancemethod), some are interesting to play around with (like code), and most are useless (like the many iterator types).
+
+In lazy mode (see LAZY in run), nothing is walked at startup. Instead a module-level __getattr__ (PEP 562) is added to every loaded module, or under Python 3.5 and 3.6 the class of every plain module is changed to a module subclass with a __getattr__ method. The first time a missing attribute is looked up, the type hierarchy is walked once to build a name index, and the type is looked up there and set on its module. The hooks are then removed again from all modules that have no types in the index. Names are the same as in normal mode. Note that hidden builtin types can only be accessed as attributes (e.g. builtins.code) until they have been looked up once, because plain names are looked up directly in the builtins dict, which does not support __getattr__. Python 2 supports neither way of hooking a module, so there lazy mode is ignored and all types are made available at startup.
+
+Types that are created later (for example by importing more modules) can be made available by calling refresh_types(), which is added to the builtins. It only processes types that were not seen in an earlier pass. If REFRESH_ON_IMPORT is enabled, it is also called automatically shortly after imports that loaded new modules. A refresh still has to look at every existing type to find the new ones, so imports that happen close together only cause a single refresh.
+"""
 
 from __future__ import absolute_import, division, print_function
 
+# run() adds attributes to the modules that own hidden types, which other submodules don't touch.
+DEPENDS_ON = ()
+MUTATES = ("module attributes", "builtins.refresh_types", "builtins.__import__")
+
 def run():
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
     import importlib
     import re
     import sys
+    import threading
+    import traceback
     import types
     
+    # Set this to True to only make types available when they are first accessed. See the module docstring for details.
+    # Has no effect under Python 2.
+    LAZY = False
+    # Set this to True to call refresh_types() after (top-level) imports that loaded new modules.
+    # Every refresh walks the entire type hierarchy, so its cost grows with the total number of types, not the number of new ones (roughly 50 ms with 20000 classes). To keep this from slowing down every import, the refresh is delayed by REFRESH_DELAY seconds, and all imports in the meantime are covered by the same refresh.
+    REFRESH_ON_IMPORT = False
+    REFRESH_DELAY = 0.5
+    
     print(u"Making all types available...")
     
-    def restore_types(cls):
+    INVALID_NAME_RE = re.compile(r"(^[0-9]|[^A-Za-z0-9]+)")
+    
+    # Sentinel for missing module attributes, so that each name only needs a single lookup.
+    missing = object()
+    
+    # Cache of module name -> module, or None if the module cannot be imported.
+    modules = {}
+    # Cache of type name -> sanitized attribute name.
+    sanitized_names = {}
+    # Per module: id of each type that was found or set under a suffixed name -> that name, and the next suffix number to try for each base name.
+    # This way the _0, _1, ... suffixes don't need to be probed from the start every time two types have the same name.
+    suffixed = {}
+    next_suffix = {}
+    
+    def get_module(modname):
         try:
-            mod = importlib.import_module(cls.__module__)
-        except ImportError:
-            return
+            return modules[modname]
+        except KeyError:
+            try:
+                mod = importlib.import_module(modname)
+            except ImportError:
+                mod = None
+            modules[modname] = mod
+            return mod
+    
+    def sanitize(name):
+        try:
+            return sanitized_names[name]
+        except KeyError:
+            sanitized = sanitized_names[name] = INVALID_NAME_RE.sub("_", name)
+            return sanitized
+    
+    def choose_name(mod, cls, lookup):
+        """Return the name under which cls should be added to mod, or None if it is already there. lookup(mod, name, missing) must return the current value of the attribute, or missing."""
+        
+        name = sanitize(cls.__name__)
+        
+        existing = lookup(mod, name, missing)
+        if existing is missing:
+            return name
+        elif existing == cls:
+            return None
+        
+        if not isinstance(existing, type):
+            name += "___class__"
+            
+            existing = lookup(mod, name, missing)
+            if existing is missing:
+                return name
+            elif existing == cls:
+                return None
         
-        name = re.sub(r"(^[0-9]|[^A-Za-z0-9]+)", "_", cls.__name__)
+        index = suffixed.setdefault(id(mod), {})
+        found = index.get(id(cls))
+        if found is not None and found.startswith(name + "_") and lookup(mod, found, missing) is cls:
+            return None
         
-        do_set = True
+        counters = next_suffix.setdefault(id(mod), {})
+        i = counters.get(name, 0)
         
-        if hasattr(mod, name):
-            if getattr(mod, name) == cls:
-                do_set = False
+        while True:
+            suffixed_name = name + "_" + str(i)
+            i += 1
+            existing = lookup(mod, suffixed_name, missing)
             
-            if do_set:
-                if not isinstance(getattr(mod, name), type):
-                    name += "___class__"
+            if existing is missing:
+                index[id(cls)] = suffixed_name
+                counters[name] = i
+                return suffixed_name
+            
+            index[id(existing)] = suffixed_name
+            if existing == cls:
+                counters[name] = i
+                return None
+    
+    # id -> type for every type that was already processed by an earlier pass.
+    # The types are kept alive, so that their ids can't be reused by new types.
+    processed = {}
+    
+    def walk():
+        """Yield every type that was not processed yet, exactly once, depth-first and in the same order as __subclasses__.
+        Types with multiple bases are reachable through more than one path, but are only yielded the first time.
+        Already processed types still need to be traversed, because new types may be subclasses of them, but that only costs one __subclasses__ call each."""
+        
+        seen = set()
+        stack = [object]
+        
+        while stack:
+            cls = stack.pop()
+            if id(cls) in seen:
+                continue
+            seen.add(id(cls))
+            
+            if id(cls) not in processed:
+                processed[id(cls)] = cls
+                yield cls
+            
+            try:
+                subs = cls.__subclasses__()
+            except TypeError:
+                subs = type(cls).__subclasses__(cls)
+            
+            stack.extend(sub for sub in reversed(subs) if id(sub) not in seen)
+    
+    # Module name -> {attribute name: type} for all types that are not set on their module yet.
+    # Built on the first lookup of a missing attribute.
+    index = {}
+    built = []
+    
+    def lookup_lazy(mod, name, default):
+        # Module dicts are used directly here, so that the lazy __getattr__ is not called recursively.
+        value = index.get(mod.__name__, {}).get(name, missing)
+        if value is missing:
+            value = vars(mod).get(name, default)
+        return value
+    
+    def index_types():
+        for cls in walk():
+            mod = get_module(cls.__module__)
+            if mod is not None:
+                name = choose_name(mod, cls, lookup_lazy)
+                if name is not None:
+                    index.setdefault(mod.__name__, {})[name] = cls
+                    install(mod)
+    
+    refresh_lock = threading.RLock()
+    
+    def refresh():
+        """Make all types available that were created since the last pass."""
+        
+        with refresh_lock:
+            if not LAZY:
+                for cls in walk():
+                    mod = get_module(cls.__module__)
+                    if mod is not None:
+                        name = choose_name(mod, cls, getattr)
+                        if name is not None:
+                            setattr(mod, name, cls)
+            elif built:
+                index_types()
+    
+    # The timer of the refresh that is scheduled by the import hook, if any.
+    # This has its own lock, so that an import doesn't have to wait for a refresh that is running.
+    scheduled = []
+    schedule_lock = threading.Lock()
+    
+    def scheduled_refresh():
+        with schedule_lock:
+            del scheduled[:]
+        try:
+            refresh()
+        except Exception:
+            traceback.print_exc()
+    
+    def schedule_refresh():
+        with schedule_lock:
+            if not scheduled:
+                timer = threading.Timer(REFRESH_DELAY, scheduled_refresh)
+                timer.daemon = True
+                scheduled.append(timer)
+                timer.start()
+    
+    def _make_new_import():
+        _real_import = builtins.__import__
+        state = threading.local()
+        
+        def __import__(name, *args, **kwargs):
+            # Only refresh once the outermost import is done, and not after every import nested in it.
+            depth = getattr(state, "depth", 0)
+            module_count = len(sys.modules)
+            state.depth = depth + 1
+            try:
+                return _real_import(name, *args, **kwargs)
+            finally:
+                state.depth = depth
+                if depth == 0 and len(sys.modules) != module_count:
+                    schedule_refresh()
+        
+        __import__.restore_types_refresh = True
+        
+        return __import__
+    
+    def build_index():
+        with refresh_lock:
+            if not built:
+                index_types()
+                built.append(True)
                 
-                if hasattr(mod, name):
-                    if getattr(mod, name) == cls:
-                        do_set = False
-                    
-                    if do_set:
-                        basename = name
-                        i = 0
-                        name = basename + "_" + str(i)
-                        
-                        while hasattr(mod, name):
-                            if getattr(mod, name) == cls:
-                                do_set = False
-                                break
-                            i += 1
-                            name = basename + "_" + str(i)
-        
-        if do_set:
+                # The hooks were only needed on all modules to notice the first lookup.
+                # The index is keyed by __name__, which is not always the same as the key in sys.modules (e.g. _io.__name__ is "io").
+                for mod in list(sys.modules.values()):
+                    if getattr(mod, "__name__", None) not in index:
+                        uninstall(mod)
+    
+    def resolve(mod, name):
+        # Special names are looked up by the import system and many other libraries all the time, and are never type names.
+        if name.startswith("__") and name.endswith("__"):
+            return missing
+        
+        build_index()
+        cls = index.get(mod.__name__, {}).pop(name, missing)
+        if cls is not missing:
             setattr(mod, name, cls)
+        return cls
+    
+    def make_getattr(mod, chained):
+        def __getattr__(name):
+            cls = resolve(mod, name)
+            if cls is not missing:
+                return cls
+            elif chained is not None:
+                return chained(name)
+            else:
+                raise AttributeError(u"module {!r} has no attribute {!r}".format(mod.__name__, name))
         
-        try:
-            subs = cls.__subclasses__()
-        except TypeError:
-            subs = type(cls).__subclasses__(cls)
+        __getattr__.restore_types_lazy = True
+        __getattr__.chained = chained
+        return __getattr__
+    
+    class LazyTypesModuleType(types.ModuleType):
+        """Class that plain modules are changed to under Python 3.5 and 3.6, which have no module __getattr__ support, but allow changing the class of a module."""
         
-        for sub in subs:
-            restore_types(sub)
+        def __getattr__(self, name):
+            cls = resolve(self, name)
+            if cls is missing:
+                raise AttributeError(u"module {!r} has no attribute {!r}".format(self.__name__, name))
+            return cls
+    
+    def install(mod):
+        if not isinstance(mod, types.ModuleType):
+            return
+        
+        if sys.version_info >= (3, 7):
+            chained = vars(mod).get("__getattr__")
+            if not getattr(chained, "restore_types_lazy", False):
+                mod.__getattr__ = make_getattr(mod, chained)
+            return
+        
+        # Modules that already have a custom class are left alone, their class can't be replaced safely.
+        if type(mod) is types.ModuleType:
+            mod.__class__ = LazyTypesModuleType
+        if type(mod) is LazyTypesModuleType:
+            return
+        
+        # The module can't be hooked, so its types are set right away.
+        names = index.get(mod.__name__, {})
+        while names:
+            name, cls = names.popitem()
+            setattr(mod, name, cls)
+    
+    def uninstall(mod):
+        if not isinstance(mod, types.ModuleType):
+            return
+        
+        if sys.version_info >= (3, 7):
+            hook = vars(mod).get("__getattr__")
+            if getattr(hook, "restore_types_lazy", False):
+                if hook.chained is None:
+                    del mod.__getattr__
+                else:
+                    mod.__getattr__ = hook.chained
+        elif type(mod) is LazyTypesModuleType:
+            mod.__class__ = types.ModuleType
+    
+    if LAZY and sys.version_info < (3, 5):
+        # There is no way to notice the first lookup of a missing module attribute, so the types are made available right away.
+        print(u"Lazy mode is not supported under Python 2, making all types available right away.")
+        LAZY = False
+    
+    if not LAZY:
+        refresh()
+    else:
+        for mod in list(sys.modules.values()):
+            install(mod)
+    
+    # refresh() is only made available now that everything it uses is defined. Otherwise an import on another thread could call it too early.
+    builtins.refresh_types = refresh
     
-    restore_types(object)
+    if REFRESH_ON_IMPORT and not getattr(builtins.__import__, "restore_types_refresh", False):
+        builtins.__import__ = _make_new_import()
     
-    print(u"Done making all types available.")
+    if LAZY:
+        print(u"Done making all types available lazily.")
+    else:
+        print(u"Done making all types available.")
 
 if __name__ == "__main__":
     run()